@@ -0,0 +1,336 @@
+import mmap
+import struct
+import sys
+from bisect import bisect_right
+
+import data
+import replay
+from engine import Game
+from rollout import capture, rebuild
+
+"""
+An archive is a replay log with keyframes of the game's
+state and an index of them, so that it can be opened at any
+piece or time by loading one keyframe and replaying at most
+a bounded number of events after it.
+
+file:     MAGIC, VERSION (one byte), a replay.Header, then
+          the events of the log as in replay.py (without its
+          end marker), the keyframes, the index and the footer
+index:    one INDEX entry per keyframe, in order
+footer:   FOOTER, ending with MAGIC
+keyframe: KEYFRAME, the codes of the current and next shapes
+          and the stockpile (one byte each), the number and
+          codes of the previous shapes, the rng's state, the
+          number of rows stored and the code of each of their
+          cells. rows above those are empty.
+
+shapes are coded by their index in the shape set, with
+EMPTY for an empty stockpile slot. cells are coded with
+1 + that index, or 0 for an empty cell.
+"""
+MAGIC = b'TARC'
+VERSION = 1
+EMPTY = 255
+PIECES_PER_KEYFRAME = 64
+EVENTS_PER_KEYFRAME = 2048  # keyframes are also taken this often, so idle stretches stay cheap
+
+KEYFRAME = struct.Struct('<hhBBQQQ')    # pos.x, pos.y, rot, over, lines, score, combo
+RNG_STATE = struct.Struct('<625I')      # the state of a random.Random, without its version
+INDEX = struct.Struct('<IIQQQIB')       # event, piece, time in ms, event offset,
+#                                         keyframe offset, keyframe length, at_lock
+FOOTER = struct.Struct('<QIIQQ4s')      # index offset, keyframes, events, lines, score, MAGIC
+
+
+class Keyframe:
+    """
+    Where a keyframe is, and when it was taken.
+    """
+    event: int          # number of events before it
+    piece: int          # number of shapes locked before it
+    time_ms: int        # time of the last event before it
+    event_offset: int   # file offset of the next event
+    offset: int         # file offset of the keyframe
+    length: int
+    at_lock: bool       # True if taken just as piece was locked
+
+    def __init__(self, event: int, piece: int, time_ms: int, event_offset: int,
+                 offset: int, length: int, at_lock: bool):
+        self.event = event
+        self.piece = piece
+        self.time_ms = time_ms
+        self.event_offset = event_offset
+        self.offset = offset
+        self.length = length
+        self.at_lock = at_lock
+
+    def pack(self):
+        return INDEX.pack(self.event, self.piece, self.time_ms, self.event_offset,
+                          self.offset, self.length, self.at_lock)
+
+
+def encode_state(game: Game):
+    """
+    returns the state of a game as the bytes of a keyframe.
+    """
+    names = tuple(data.SHAPES[game.shape_size][game.shape_set].keys())
+    codes = {name: code for code, name in enumerate(names)}
+    codes[data.SHAPE_EMPTY_NAME] = EMPTY
+    state = capture(game)
+
+    out = bytearray(KEYFRAME.pack(
+        state['pos'][0], state['pos'][1], state['rot'], state['over'],
+        state['lines'], state['score'], state['combo']
+    ))
+    out.append(codes[state['curr_shape']])
+    out.append(codes[state['next_shape']])
+    out += bytes(codes[name] for name in state['stockpile'])
+    prev_shapes = state['prev_shapes']
+    replay.write_varint(out, len(prev_shapes))
+    out += bytes(codes[name] for name in prev_shapes)
+
+    version, internal, gauss_next = game.rng.getstate()
+    assert version == 3 and gauss_next is None
+    out += RNG_STATE.pack(*internal)
+
+    cells = state['cells']
+    used = max((y + 1 for y in range(len(cells)) if game.row_fill[y]), default=0)
+    replay.write_varint(out, used)
+    for row in cells[:used]:
+        out += bytes(0 if key is data.CELL_EMPTY_KEY else 1 + codes[key] for key in row)
+    return bytes(out)
+
+
+def decode_state(buf, header: replay.Header):
+    """
+    returns a new Game in the state of a keyframe,
+    with the seed of the archive it came from.
+    """
+    shape_size, num_rows, num_cols, shape_set = header.settings
+    names = tuple(data.SHAPES[shape_size][shape_set].keys())
+    pos_x, pos_y, rot, over, lines, score, combo = KEYFRAME.unpack_from(buf, 0)
+    pos = KEYFRAME.size
+    curr_shape, next_shape = names[buf[pos]], names[buf[pos + 1]]
+    pos += 2
+    stockpile = tuple(
+        data.SHAPE_EMPTY_NAME if code == EMPTY else names[code]
+        for code in buf[pos:pos + shape_size]
+    )
+    pos += shape_size
+    count, pos = replay.read_varint(buf, pos)
+    prev_shapes = tuple(names[code] for code in buf[pos:pos + count])
+    pos += count
+    internal = RNG_STATE.unpack_from(buf, pos)
+    pos += RNG_STATE.size
+
+    used, pos = replay.read_varint(buf, pos)
+    keys = (data.CELL_EMPTY_KEY, ) + names
+    empty_row = (data.CELL_EMPTY_KEY, ) * num_cols
+    cells = []
+    for y in range(num_rows + int(shape_size / 2) + 1):
+        if y < used:
+            cells.append(tuple(keys[code] for code in buf[pos:pos + num_cols]))
+            pos += num_cols
+        else:
+            cells.append(empty_row)
+
+    game = rebuild({
+        'settings': header.settings,
+        'cells': cells,
+        'curr_shape': curr_shape,
+        'next_shape': next_shape,
+        'stockpile': stockpile,
+        'prev_shapes': prev_shapes,
+        'pos': (pos_x, pos_y),
+        'rot': rot,
+        'lines': lines,
+        'score': score,
+        'combo': combo,
+        'over': bool(over),
+    })
+    game.seed = header.seed
+    game.rng.setstate((3, internal, None))
+    game.rng_checkpoint = None
+    return game
+
+
+def write(log, path: str, pieces_per_keyframe: int = PIECES_PER_KEYFRAME,
+          events_per_keyframe: int = EVENTS_PER_KEYFRAME):
+    """
+    writes an archive of a replay log to path, taking a keyframe
+    at the start, every pieces_per_keyframe locked shapes, and
+    after events_per_keyframe events without one.
+    returns the final Game.
+    """
+    header, events, end = replay.read(log)
+    game = header.new_game()
+    keyframes = []
+    frames = bytearray()
+    with open(path, 'wb') as f:
+        f.write(MAGIC + bytes((VERSION, )) + header.to_bytes())
+        chunk = bytearray()
+        event_offset = f.tell()
+        piece = time_ms = since = 0
+
+        def keyframe(event: int, at_lock: bool):
+            state = encode_state(game)
+            keyframes.append(Keyframe(event, piece, time_ms, event_offset + len(chunk),
+                                      len(frames), len(state), at_lock))
+            frames.extend(state)
+
+        keyframe(0, False)
+        for i, (delay, action, slot) in enumerate(events):
+            replay.write_varint(chunk, delay)
+            chunk.append(replay.encode(action, slot))
+            time_ms += delay
+            since += 1
+            locked = game.tick() if action is None else game.step(action, slot)
+            if locked:
+                piece += 1
+            if (locked and piece % pieces_per_keyframe == 0) or since >= events_per_keyframe:
+                keyframe(i + 1, locked)
+                since = 0
+            if len(chunk) >= 1 << 16:
+                f.write(chunk)
+                event_offset += len(chunk)
+                chunk.clear()
+        f.write(chunk)
+
+        if end is not None:
+            assert (game.lines, game.score) == end, 'replay diverged from the log'
+        frames_offset = f.tell()
+        f.write(frames)
+        index_offset = f.tell()
+        for entry in keyframes:
+            entry.offset += frames_offset
+            f.write(entry.pack())
+        f.write(FOOTER.pack(index_offset, len(keyframes), len(events),
+                            game.lines, game.score, MAGIC))
+    return game
+
+
+class Archive:
+    """
+    A memory-mapped archive, which makes Games
+    in the state at any piece, time or event.
+    Use as a context manager, or call close().
+    """
+    header: replay.Header
+    keyframes: [Keyframe, ]
+    num_events: int
+    lines: int          # of the game at the end of the archive
+    score: int
+    file = None
+    buf: mmap.mmap
+
+    def __init__(self, path: str):
+        self.file = open(path, 'rb')
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self.buf[:len(MAGIC)] == MAGIC, 'not a replay archive'
+        assert self.buf[len(MAGIC)] == VERSION, 'unknown archive version %d' % self.buf[len(MAGIC)]
+        self.header, _ = replay.Header.from_bytes(self.buf, len(MAGIC) + 1)
+
+        index_offset, count, self.num_events, self.lines, self.score, magic = \
+            FOOTER.unpack_from(self.buf, len(self.buf) - FOOTER.size)
+        assert magic == MAGIC, 'archive is truncated'
+        self.keyframes = [
+            Keyframe(*INDEX.unpack_from(self.buf, index_offset + i * INDEX.size))
+            for i in range(count)
+        ]
+        self._events = [entry.event for entry in self.keyframes]
+        self._times = [entry.time_ms for entry in self.keyframes]
+        self._pieces = [(entry.piece, not entry.at_lock) for entry in self.keyframes]
+
+    def load(self, entry: Keyframe):
+        return decode_state(self.buf[entry.offset:entry.offset + entry.length], self.header)
+
+    def _play(self, entry: Keyframe, stop: callable):
+        """
+        returns the Game at entry, with the events after it
+        applied until stop(event, piece, time_ms) is True
+        before the next event, given the number of events and
+        locked shapes so far and the time of the next event.
+        """
+        game = self.load(entry)
+        event, piece, time_ms = entry.event, entry.piece, entry.time_ms
+        pos = entry.event_offset
+        while event < self.num_events:
+            delay, after = replay.read_varint(self.buf, pos)
+            if stop(event, piece, time_ms + delay):
+                break
+            action, slot = replay.decode(self.buf[after])
+            pos = after + 1
+            if game.tick() if action is None else game.step(action, slot):
+                piece += 1
+            event += 1
+            time_ms += delay
+        return game
+
+    def at_event(self, n: int):
+        """
+        returns a Game in its state after the first n events.
+        """
+        entry = self.keyframes[bisect_right(self._events, n) - 1]
+        return self._play(entry, lambda event, piece, time_ms: event >= n)
+
+    def at_piece(self, n: int):
+        """
+        returns a Game in its state just after its n-th shape
+        was locked, or at the end if fewer were locked.
+        """
+        entry = self.keyframes[max(bisect_right(self._pieces, (n, False)) - 1, 0)]
+        return self._play(entry, lambda event, piece, time_ms: piece >= n)
+
+    def at_time(self, seconds: float):
+        """
+        returns a Game in its state after every event
+        that happened within seconds of the start.
+        """
+        limit = int(seconds * 1000)
+        entry = self.keyframes[max(bisect_right(self._times, limit) - 1, 0)]
+        return self._play(entry, lambda event, piece, time_ms: time_ms > limit)
+
+    def duration(self):
+        """
+        returns the time of the last event, in seconds.
+        """
+        entry = self.keyframes[-1]
+        time_ms = entry.time_ms
+        pos = entry.event_offset
+        for _ in range(entry.event, self.num_events):
+            delay, pos = replay.read_varint(self.buf, pos)
+            time_ms += delay
+            pos += 1
+        return time_ms / 1000
+
+    def close(self):
+        if self.file is None:
+            return
+        self.buf.close()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    if len(sys.argv) != 3:
+        print('usage: python archive.py LOG ARCHIVE')
+        return 1
+    with open(sys.argv[1], 'rb') as f:
+        log = f.read()
+    game = write(log, sys.argv[2])
+    with Archive(sys.argv[2]) as archive:
+        print('%d events, %d keyframes, %.1f seconds. lines %d score %d' % (
+            archive.num_events, len(archive.keyframes), archive.duration(),
+            game.lines, game.score
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,471 @@
+import numpy as np
+
+import data
+
+_RCC, _RCW, _TSD, _THD, _TSL, _THL, _TSR, _THR, _STOCKPILE, _PAUSE, _RESTART = (
+    data.ACTIONS.index(action) for action in (
+        data.RCC, data.RCW, data.TSD, data.THD, data.TSL, data.THL,
+        data.TSR, data.THR, data.STOCKPILE, data.PAUSE, data.RESTART
+    )
+)
+WALL = 255  # value of the border cells around each board
+MAX_BITS = 52  # boards up to this many rows and columns also keep row and column bitmasks
+
+
+def highest_bit(values: np.ndarray):
+    """
+    returns the index of the highest set bit of each of
+    an array of values below 2 ** 53, or -1 for 0.
+    """
+    # exact, since every such value is a float64
+    return np.frexp(values.astype(np.float64))[1] - 1
+
+
+class BatchGame:
+    """
+    Many independent games of the same size and
+    shape set, stepped together with NumPy.
+
+    Follows the rules of engine.Game: the same
+    shapes from data.SHAPES, spawning, collisions,
+    stockpile swaps, line clears and scoring.
+    Actions are given as codes: indices into
+    data.ACTIONS. data.PAUSE has no effect.
+
+    Each board is surrounded by a border of wall cells
+    at least shape_size thick, so that every cell a shape
+    can be tested against is a single flat array lookup.
+    Boards of at most MAX_BITS rows and columns also keep
+    a bitmask of each row and column, so that drops and
+    slides are found in one step for every tile.
+
+    Representation Invariant:
+    boards[g, y, x] is 0 for an empty cell, or
+    1 + the index in names of the shape that filled it.
+    stock[g, slot] and pieces are indices into names,
+    where -1 is an empty stockpile slot.
+    """
+    shape_size: int
+    shape_set: str
+    names: (str, )              # shape names. index + 1 is a board value
+    num_games: int
+    num_rows: int               # visible rows. lines only clear below this
+    num_cols: int
+    walled: np.ndarray          # (num_games, pad + rows incl. hidden + pad, pad + cols + pad)
+    boards: np.ndarray          # view of walled without the border
+    flat: np.ndarray            # 1D view of walled
+    origin: np.ndarray          # (num_games, ) index in flat of each board's cell (0, 0)
+    offsets: np.ndarray         # (len(names), 4, tiles) flat offsets of each tile in walled
+    tile_x: np.ndarray          # (len(names), 4, tiles) x offset of each tile from the pivot
+    tile_y: np.ndarray          # (len(names), 4, tiles) y offset of each tile from the pivot
+    row_bits: np.ndarray = None  # (num_games, rows incl. hidden) bit x set if boards[g, y, x] != 0
+    col_bits: np.ndarray = None  # (num_games, num_cols) bit y set if boards[g, y, x] != 0
+
+    piece: np.ndarray           # (num_games, ) index of the current shape
+    next_piece: np.ndarray      # (num_games, ) index of the next shape
+    stock: np.ndarray           # (num_games, shape_size) indices of stockpiled shapes
+    rot: np.ndarray             # (num_games, ) rotation of the current shape
+    x: np.ndarray               # (num_games, ) pivot column of the current shape
+    y: np.ndarray               # (num_games, ) pivot row of the current shape
+    lines: np.ndarray           # (num_games, )
+    score: np.ndarray           # (num_games, )
+    combo: np.ndarray           # (num_games, )
+    over: np.ndarray            # (num_games, ) bool
+
+    history: np.ndarray         # (num_games, data.SHAPE_QUEUE_SIZE) ring of previous shapes
+    counts: np.ndarray          # (num_games, len(names)) occurrences of each shape in history
+    rng: np.random.Generator
+    sequences: np.ndarray = None  # (num_games, length) optional shapes to draw in order
+    seq_pos: np.ndarray = None    # (num_games, ) index in sequences of the next shape to draw
+
+    def __init__(self, num_games: int,
+                 shape_size: int = data.DEFAULT_SHAPE_SIZE,
+                 num_rows: int = None,
+                 num_cols: int = None,
+                 shape_set: str = 'default',
+                 seed: int = None,
+                 sequences: np.ndarray = None):
+        """
+        sequences gives each game the indices into names
+        of the shapes it draws, such as from
+        sequences.generate. games draw random shapes
+        once they reach the end of their sequence.
+        """
+        if num_rows is None:
+            num_rows = data.DEFAULT_NUM_ROWS[shape_size]
+        if num_cols is None:
+            num_cols = data.DEFAULT_NUM_COLS[shape_size]
+        self.shape_size = shape_size
+        self.shape_set = shape_set
+        self.num_games = num_games
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.rng = np.random.default_rng(seed)
+        if sequences is not None:
+            assert len(sequences) == num_games
+            self.sequences = np.asarray(sequences)
+            self.seq_pos = np.zeros(num_games, np.int64)
+
+        height = num_rows + int(shape_size / 2) + 1
+        self.pad = shape_size
+        self.walled = np.full(
+            (num_games, height + 2 * self.pad, num_cols + 2 * self.pad), WALL, np.uint8
+        )
+        self.boards = self.walled[:, self.pad:-self.pad, self.pad:-self.pad]
+        self.flat = self.walled.reshape(-1)
+        self.row_len = self.walled.shape[2]
+        self.board_len = self.walled.shape[1] * self.row_len
+        self.origin = np.arange(num_games) * self.board_len + self.pad * (self.row_len + 1)
+
+        # tile offset tables, padded by repeating the first tile to a
+        # multiple of 4, so that _fits tests 4 tiles as one uint32
+        shapes = data.SHAPES[shape_size][shape_set]
+        self.names = tuple(shapes.keys())
+        num_tiles = max(len(shape.tiles) for shape in shapes.values())
+        num_tiles += -num_tiles % 4
+        self.offsets = np.zeros((len(self.names), 4, num_tiles), np.int64)
+        self.tile_x = np.zeros((len(self.names), 4, num_tiles), np.int64)
+        self.tile_y = np.zeros((len(self.names), 4, num_tiles), np.int64)
+        for i, shape in enumerate(shapes.values()):
+            for rot in range(4):
+                offsets = shape.offsets[rot]
+                offsets = offsets + (offsets[0], ) * (num_tiles - len(offsets))
+                self.offsets[i, rot] = [x + y * self.row_len for x, y in offsets]
+                self.tile_x[i, rot] = [x for x, y in offsets]
+                self.tile_y[i, rot] = [y for x, y in offsets]
+        if height <= MAX_BITS and num_cols <= MAX_BITS:
+            self.row_bits = np.zeros((num_games, height), np.int64)
+            self.col_bits = np.zeros((num_games, num_cols), np.int64)
+        self.spawn_y = np.array(
+            [num_rows - 1 - shape.extremes[0][2] for shape in shapes.values()]
+        )
+        self.piece = np.zeros(num_games, np.int64)
+        self.next_piece = np.zeros(num_games, np.int64)
+        self.stock = np.full((num_games, shape_size), -1, np.int64)
+        self.rot = np.zeros(num_games, np.int64)
+        self.x = np.zeros(num_games, np.int64)
+        self.y = np.zeros(num_games, np.int64)
+        self.lines = np.zeros(num_games, np.int64)
+        self.score = np.zeros(num_games, np.int64)
+        self.combo = np.zeros(num_games, np.int64)
+        self.over = np.zeros(num_games, bool)
+        self.history = np.full((num_games, data.SHAPE_QUEUE_SIZE), -1, np.int64)
+        self.history_pos = np.zeros(num_games, np.int64)
+        self.counts = np.zeros((num_games, len(self.names)), np.int64)
+        self.restart(np.arange(num_games))
+
+    def restart(self, games: np.ndarray):
+        """
+        starts the games at the given indices over.
+        """
+        if games.size == 0:
+            return
+        self.boards[games] = 0
+        if self.row_bits is not None:
+            self.row_bits[games] = 0
+            self.col_bits[games] = 0
+        if self.sequences is not None:
+            self.seq_pos[games] = 0
+        self.stock[games] = -1
+        self.lines[games] = 0
+        self.score[games] = 0
+        self.combo[games] = 0
+        self.over[games] = False
+        self.history[games] = -1
+        self.history_pos[games] = 0
+        self.counts[games] = 0
+        self.next_piece[games] = self._draw(games)
+        self.piece[games] = -1  # nothing to remember on the first spawn
+        self._spawn(games)
+
+    def step(self, actions: np.ndarray, slots: np.ndarray = None):
+        """
+        applies one action code per game. slots
+        selects the stockpile slot for each game
+        whose action is data.STOCKPILE.
+
+        returns a bool array of the games whose
+        current shape was locked by this step.
+        """
+        actions = np.asarray(actions)
+        locked = np.zeros(self.num_games, bool)
+        self.restart(np.flatnonzero(actions == _RESTART))
+        live = ~self.over
+
+        def games(code):
+            return np.flatnonzero(live & (actions == code))
+
+        self._rotate(games(_RCC), 3)
+        self._rotate(games(_RCW), 1)
+        self._shift(games(_TSL), -1, 1)
+        self._shift(games(_THL), -1, self.num_cols)
+        self._shift(games(_TSR), 1, 1)
+        self._shift(games(_THR), 1, self.num_cols)
+
+        soft = games(_TSD)
+        down = self._fits(
+            soft, self.piece[soft], self.rot[soft], self.x[soft], self.y[soft] - 1
+        )
+        self.y[soft[down]] -= 1
+        locked[soft[~down]] = True
+        hard = games(_THD)
+        self.y[hard] -= self._drop_distance(hard)
+        locked[hard] = True
+
+        stocked = games(_STOCKPILE)
+        if stocked.size:
+            if slots is None:
+                slots = np.zeros(self.num_games, np.int64)
+            self._stockpile_access(stocked, np.asarray(slots)[stocked])
+
+        self._lock(np.flatnonzero(locked))
+        return locked
+
+    def tick(self):
+        """
+        one step of gravity for every game still
+        being played. returns the games that locked.
+        """
+        return self.step(np.where(self.over, _PAUSE, _TSD))
+
+    def _cells(self, games, piece, rot, x, y):
+        """
+        returns the indices in flat of each tile of the
+        shapes in rotations rot with their pivots at (x, y).
+        """
+        pivot = self.origin[games] + y * self.row_len + x
+        return pivot[:, None] + self.offsets[piece, rot]
+
+    def _fits(self, games, piece, rot, x, y):
+        cells = self._cells(games, piece, rot, x, y)
+        words = self.flat[cells].view(np.uint32)
+        if words.shape[1] == 1:
+            return words[:, 0] == 0
+        return ~words.any(axis=1)
+
+    def _rotate(self, games, angle: int):
+        if games.size == 0:
+            return
+        rot = (self.rot[games] + angle) % 4
+        ok = self._fits(games, self.piece[games], rot, self.x[games], self.y[games])
+        self.rot[games[ok]] = rot[ok]
+
+    def _tiles(self, games):
+        """
+        returns the x and y of each tile of the games' shapes.
+        """
+        piece, rot = self.piece[games], self.rot[games]
+        return (self.x[games][:, None] + self.tile_x[piece, rot],
+                self.y[games][:, None] + self.tile_y[piece, rot])
+
+    def _shift(self, games, dx: int, limit: int):
+        """
+        moves the games' shapes up to limit columns by dx,
+        as far as each can go.
+        """
+        if games.size == 0:
+            return
+        if limit == 1:
+            ok = self._fits(
+                games, self.piece[games], self.rot[games], self.x[games] + dx, self.y[games]
+            )
+            self.x[games[ok]] += dx
+            return
+        limit = min(limit, self.num_cols)   # the side walls are within num_cols of every tile
+        if self.row_bits is not None:
+            # the nearest filled cell in each tile's row on that side
+            x, y = self._tiles(games)
+            row = self.row_bits[games[:, None], y]
+            if dx < 0:
+                free = x - 1 - highest_bit(row & ((1 << x) - 1))
+            else:
+                beyond = row >> (x + 1)
+                free = np.where(beyond > 0, highest_bit(beyond & -beyond), self.num_cols - 1 - x)
+        else:
+            # look along the rows of all the tiles at once
+            cells = self._cells(
+                games, self.piece[games], self.rot[games], self.x[games], self.y[games]
+            )
+            blocked = self.flat[cells[:, :, None] + dx * np.arange(1, limit + 1)] != 0
+            free = np.where(blocked.any(axis=2), blocked.argmax(axis=2), limit)
+        self.x[games] += dx * np.minimum(free.min(axis=1), limit)
+
+    def _drop_distance(self, games):
+        """
+        returns how far each game's shape can fall: from
+        the highest filled cell under each tile's column,
+        or by looking down every column under its tiles.
+        """
+        if games.size == 0:
+            return np.zeros(0, np.int64)
+        if self.col_bits is not None:
+            x, y = self._tiles(games)
+            below = self.col_bits[games[:, None], x] & ((1 << y) - 1)
+            return (y - 1 - highest_bit(below)).min(axis=1)
+        cells = self._cells(
+            games, self.piece[games], self.rot[games], self.x[games], self.y[games]
+        )
+        depth = np.arange(1, self.boards.shape[1] + 2) * self.row_len
+        below = self.flat[cells[:, :, None] - depth] != 0
+        # the floor is wall, so every column has a first occupied cell
+        return below.argmax(axis=2).min(axis=1)
+
+    def _stockpile_access(self, games, slots):
+        stored = self.stock[games, slots]
+        empty = stored < 0
+        # empty slot: store the current shape and spawn the next
+        g = games[empty]
+        self.stock[g, slots[empty]] = self.piece[g]
+        self._spawn(g)
+        # otherwise swap if the stored shape has room at rotation 0
+        g = games[~empty]
+        s = slots[~empty]
+        swap = stored[~empty]
+        ok = self._fits(g, swap, np.zeros(g.size, np.int64), self.x[g], self.y[g])
+        g, s, swap = g[ok], s[ok], swap[ok]
+        self.stock[g, s] = self.piece[g]
+        self.piece[g] = swap
+        self.rot[g] = 0
+
+    def _lock(self, games):
+        """
+        writes the games' current shapes into their boards,
+        clears full lines and spawns the next shapes.
+        """
+        if games.size == 0:
+            return
+        piece = self.piece[games]
+        cells = self._cells(games, piece, self.rot[games], self.x[games], self.y[games])
+        self.flat[cells] = (piece + 1)[:, None]
+        if self.row_bits is not None:
+            x, y = self._tiles(games)
+            g = np.broadcast_to(games[:, None], x.shape)
+            np.bitwise_or.at(self.row_bits, (g, y), 1 << x)
+            np.bitwise_or.at(self.col_bits, (g, x), 1 << y)
+
+        if self.row_bits is not None:
+            full = self.row_bits[games, :self.num_rows] == (1 << self.num_cols) - 1
+        else:
+            full = (self.boards[games, :self.num_rows] != 0).all(axis=2)
+        cleared = full.sum(axis=1)
+        some = cleared > 0
+        if some.any():
+            visible = self.boards[games[some], :self.num_rows]
+            # stable sort moves full rows to the top, keeping the order of the others
+            order = np.argsort(full[some], axis=1, kind='stable')
+            visible = np.take_along_axis(visible, order[:, :, None], axis=1)
+            top = np.arange(self.num_rows)[None, :] >= (self.num_rows - cleared[some])[:, None]
+            visible[top] = 0
+            self.boards[games[some], :self.num_rows] = visible
+            if self.row_bits is not None:
+                filled = self.boards[games[some]] != 0
+                self.row_bits[games[some]] = filled @ (1 << np.arange(self.num_cols))
+                self.col_bits[games[some]] = \
+                    filled.transpose(0, 2, 1) @ (1 << np.arange(filled.shape[1]))
+
+        # scoring, as in Game.handle_clears
+        tetris = cleared == self.shape_size
+        combo = np.where(tetris, self.combo[games], 0)
+        self.lines[games] += cleared
+        self.score[games] += (1 << (cleared + combo)) - 1
+        self.combo[games] = combo + tetris
+
+        self._spawn(games)
+
+    def _spawn(self, games):
+        """
+        passes on the next shape to the current shape,
+        as in Game.spawn_next_shape. games without room
+        for the next shape are over.
+        """
+        if games.size == 0:
+            return
+        nxt = self.next_piece[games]
+        self.rot[games] = 0
+        self.x[games] = int(self.num_cols / 2)
+        self.y[games] = self.spawn_y[nxt]
+        ok = self._fits(games, nxt, self.rot[games], self.x[games], self.y[games])
+        self.over[games[~ok]] = True
+        games = games[ok]
+
+        prev = self.piece[games]
+        self._remember(games[prev >= 0], prev[prev >= 0])
+        self.piece[games] = self.next_piece[games]
+        self.next_piece[games] = self._draw(games)
+
+    def _remember(self, games, pieces):
+        """
+        appends to the bounded history of previous shapes.
+        """
+        pos = self.history_pos[games]
+        forgotten = self.history[games, pos]
+        old = forgotten >= 0
+        self.counts[games[old], forgotten[old]] -= 1
+        self.history[games, pos] = pieces
+        self.counts[games, pieces] += 1
+        self.history_pos[games] = (pos + 1) % self.history.shape[1]
+
+    def _draw(self, games):
+        """
+        picks shapes weighted as in data.get_random_shape:
+        each shape is half as likely for every time it
+        appears in the history of previous shapes.
+        games with a sequence take its next shape instead.
+        """
+        picked = np.empty(games.size, np.int64)
+        rest = np.ones(games.size, bool)
+        if self.sequences is not None:
+            pos = self.seq_pos[games]
+            rest = pos >= self.sequences.shape[1]
+            have = games[~rest]
+            picked[~rest] = self.sequences[have, pos[~rest]]
+            self.seq_pos[have] += 1
+        games = games[rest]
+        weights = 0.5 ** self.counts[games]
+        total = np.cumsum(weights, axis=1)
+        choice = self.rng.random(games.size) * total[:, -1]
+        picked[rest] = np.minimum((total <= choice[:, None]).sum(axis=1), len(self.names) - 1)
+        return picked
+
+
+def benchmark(num_games: int = 10000, steps: int = 200, actions: str = 'mixed',
+              repeats: int = 3, seed: int = 0):
+    """
+    returns the best steps per second of BatchGame over
+    repeats runs of steps steps of num_games games, with
+    games that end restarted. actions is 'tick' for gravity
+    only, 'slides' for hard left and right, or 'mixed' for
+    random moves, rotations and drops.
+    """
+    import time
+    rng = np.random.default_rng(seed)
+    codes = {
+        'slides': np.array([_THL, _THR]),
+        'mixed': np.array([_RCC, _RCW, _TSD, _THD, _TSL, _THL, _TSR, _THR]),
+    }.get(actions)
+    plan = [None if codes is None else rng.choice(codes, num_games) for _ in range(steps)]
+    best = 0.0
+    for _ in range(repeats):
+        game = BatchGame(num_games, seed=seed)
+        start = time.perf_counter()
+        for step in plan:
+            if step is None:
+                game.tick()
+            else:
+                game.step(step)
+            game.restart(np.flatnonzero(game.over))
+        best = max(best, steps / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    for num_games in (1000, 10000):
+        for actions in ('tick', 'slides', 'mixed'):
+            rate = benchmark(num_games, actions=actions)
+            print('%6d games %7s: %7.0f steps/s, %6.2f M board steps/s' % (
+                num_games, actions, rate, rate * num_games / 1e6
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from shapes import Shape
+
+
+class BitBoard:
+    """
+    An occupancy mirror of a Game's grid where
+    each row is a single integer bitmask.
+
+    Each row is padded on both sides by wall bits,
+    and the bottom of the board is padded by rows
+    that are entirely wall, so that a shape can be
+    tested against the board without bounds checks.
+    """
+    pad: int        # number of wall bits / rows padding each side
+    num_cols: int   #
+    wall: int       # row value for an empty row (wall bits only)
+    full: int       # row value for a completely filled row
+    rows: [int, ]   # RI: rows[pad + y] is the mask for the grid row y
+
+    def __init__(self, num_rows: int, num_cols: int, shape_size: int):
+        """
+        num_rows is the total number of rows in the
+        Game's grid, including those above the ceiling.
+        """
+        self.pad = shape_size
+        self.num_cols = num_cols
+        side = (1 << self.pad) - 1
+        self.wall = side | (side << (self.pad + num_cols))
+        self.full = (1 << (2 * self.pad + num_cols)) - 1
+        self.rows = [self.full] * self.pad + [self.wall] * num_rows
+
+    def fits(self, shape: Shape, rot: int, x: int, y: int):
+        """
+        returns True if the shape in rotation rot with its
+        pivot at (x, y) overlaps no walls or occupied cells.
+        """
+        rows = self.rows
+        shift = x + shape.mask_x[rot] + self.pad
+        y += self.pad
+        for dy, mask in shape.masks[rot]:
+            if rows[y + dy] & (mask << shift):
+                return False
+        return True
+
+    def free(self, masks: (int, ((int, int), )), x: int, y: int):
+        """
+        returns True if none of the cells in masks, an entry of
+        Shape.edge_masks or Shape.rot_delta_masks, is a wall
+        or occupied with the shape's pivot at (x, y).
+        """
+        rows = self.rows
+        min_x, row_masks = masks
+        shift = x + min_x + self.pad
+        y += self.pad
+        for dy, mask in row_masks:
+            if rows[y + dy] & (mask << shift):
+                return False
+        return True
+
+    def place(self, shape: Shape, rot: int, x: int, y: int):
+        """
+        marks the cells covered by the shape as occupied.
+        """
+        shift = x + shape.mask_x[rot] + self.pad
+        y += self.pad
+        for dy, mask in shape.masks[rot]:
+            self.rows[y + dy] |= mask << shift
+
+    def set_cell(self, x: int, y: int, occupied: bool):
+        bit = 1 << (x + self.pad)
+        if occupied:
+            self.rows[y + self.pad] |= bit
+        else:
+            self.rows[y + self.pad] &= ~bit
+
+    def clear_rows(self, start: int, stop: int):
+        """
+        empties the grid rows in range(start, stop).
+        """
+        for y in range(start + self.pad, stop + self.pad):
+            self.rows[y] = self.wall
+
+    def remove_rows(self, lines: [int, ], ceiling: int):
+        """
+        removes the rows in lines (sorted ascending), making
+        the rows between them and the ceiling row fall.
+        """
+        lo = lines[0] + self.pad
+        hi = ceiling + self.pad
+        removed = set(y + self.pad for y in lines)
+        kept = [self.rows[y] for y in range(lo, hi) if y not in removed]
+        self.rows[lo:hi] = kept + [self.wall] * len(lines)
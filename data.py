@@ -1,4 +1,5 @@
 import random
+from collections import deque
 from math import log
 
 from shapes import Shape
@@ -55,6 +56,69 @@ def get_random_shape(shape_size: int, shape_set: str, queue: list):
     assert False  # should never reach this statement
 
 
+class ShapeHistory:
+    """
+    The last <size> shape names spawned, with a running count
+    and weight for each shape, so that appending a name and
+    drawing the next shape do not rescan the history.
+
+    Draws follow get_random_shape: each shape is half as
+    likely for every time it appears in the history.
+    Iterating gives the names from oldest to newest.
+    """
+    shapes: {str: Shape, }
+    names: deque        # RI: at most <size> names, oldest first
+    counts: {str: int, }
+    weights: {str: float, }  # RI: weights[name] is 1 / 2 ** counts[name]
+    total: float        # RI: the sum of weights. exact, as a sum of powers of two
+
+    def __init__(self, shape_size: int, shape_set: str, size: int = SHAPE_QUEUE_SIZE):
+        self.shapes = SHAPES[shape_size][shape_set]
+        self.names = deque(maxlen=size)
+        self.clear()
+
+    def clear(self):
+        self.names.clear()
+        self.counts = dict.fromkeys(self.shapes.keys(), 0)
+        self.weights = dict.fromkeys(self.shapes.keys(), 1.0)
+        self.total = float(len(self.shapes))
+
+    def _recount(self, name: str, change: int):
+        if name not in self.counts:
+            return  # from a previous shape set
+        self.total -= self.weights[name]
+        self.counts[name] += change
+        self.weights[name] = 1.0 / (2 ** self.counts[name])
+        self.total += self.weights[name]
+
+    def append(self, name: str):
+        if len(self.names) == self.names.maxlen:
+            self._recount(self.names[0], -1)
+        self.names.append(name)
+        self._recount(name, 1)
+
+    def extend(self, names: [str, ]):
+        for name in names:
+            self.append(name)
+
+    def draw(self, rng: random.Random):
+        """
+        returns a random Shape, weighted by the history.
+        """
+        choice = rng.uniform(0, self.total)
+        for key, weight in self.weights.items():
+            if choice < weight:
+                return self.shapes[key]
+            choice -= weight
+        assert False  # should never reach this statement
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
 CELL_EMPTY_KEY = ' '
 CELL_WALL_KEY = 'wall'
 
@@ -144,6 +208,13 @@ THR = 'hard right'
 STOCKPILE = 'access stockpile'
 PAUSE = 'pause game'
 RESTART = 'restart the player\'s game'
+ACTIONS = (RCC, RCW, TSD, THD, TSL, THL, TSR, THR, STOCKPILE, PAUSE, RESTART)
+UNDO = 'undo the last shape'  # gui only: not one of the ACTIONS of a Game
+UNDO_LIMIT = 32               # number of shapes that can be undone
+REPEATED_ACTIONS = (TSD, TSL, TSR)  # actions repeated while their key is held
+INPUT_TICK_MS = 10  # between input ticks, while a key is held
+DAS_MS = 170        # delayed auto shift: how long a key is held before its action repeats
+ARR_MS = 50         # auto repeat rate: between repeats, once they start
 """
 all players should have the same pause keys
 """
@@ -161,7 +232,8 @@ DEFAULT_BINDINGS = {
             THR: ('D', ),
             STOCKPILE: (('1', 'z'), ('2', 'x'), ('3', 'c'), ('4', 'v')),
             PAUSE: ('Escape', ),
-            RESTART: ('F', )
+            RESTART: ('F', ),
+            UNDO: ('BackSpace', )
         }
     },
     2: {
@@ -176,7 +248,8 @@ DEFAULT_BINDINGS = {
             THR: tuple(),
             STOCKPILE: (('1', 'z'), ('2', 'x'), ('3', 'c'), ('4', 'v')),
             PAUSE: ('Escape', 'Space'),
-            RESTART: ('F', )
+            RESTART: ('F', ),
+            UNDO: ('r', )
         },
         1: {
             RCC: ('u', ),
@@ -189,7 +262,8 @@ DEFAULT_BINDINGS = {
             THR: tuple(),
             STOCKPILE: (('7', 'b'), ('8', 'n'), ('9', 'm'), ('0', 'comma')),
             PAUSE: ('Escape', 'Space'),
-            RESTART: ('H', )
+            RESTART: ('H', ),
+            UNDO: ('p', )
         }
     }
 }
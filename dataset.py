@@ -0,0 +1,282 @@
+import glob
+import json
+import struct
+
+import numpy as np
+
+import data
+from engine import Game
+
+SHARD_BYTES = 1 << 28   # shards are rotated once they would grow past this size
+HEADER_LEN = 4096       # bytes before the records in each shard. a multiple of 64
+BUFFER_LEN = 1 << 12    # records kept in memory between writes to a shard
+EMPTY = 255             # shape code of an empty stockpile slot
+
+
+def record_dtype(shape_size: int, num_rows: int, num_cols: int):
+    """
+    returns the dtype of one record for a grid with num_rows
+    rows in total (including those above the ceiling).
+
+    board: bit (y * num_cols + x) is set if grid[y][x] is filled,
+           packed in little-endian bit order
+    curr, next, stockpile: shape codes. see Encoder.names
+    x, y, rot: the position of the current shape
+    action: the index in data.ACTIONS of the action taken
+    slot: the stockpile slot, for data.STOCKPILE
+    reward: the score gained by the action
+    """
+    return np.dtype([
+        ('board', np.uint8, ((num_rows * num_cols + 7) // 8, )),
+        ('curr', np.uint8),
+        ('next', np.uint8),
+        ('stockpile', np.uint8, (shape_size, )),
+        ('x', np.int16),
+        ('y', np.int16),
+        ('rot', np.uint8),
+        ('action', np.uint8),
+        ('slot', np.uint8),
+        ('reward', np.int32),
+    ])
+
+
+class Encoder:
+    """
+    Turns the state of Games with the same
+    settings into records of a fixed dtype.
+    """
+    settings: tuple     # (shape_size, num_rows, num_cols, shape_set) as for Game
+    num_rows: int       # total rows in a grid, including those above the ceiling
+    num_cols: int
+    names: (str, )      # shape names. a shape's code is its index here
+    codes: {str: int, }
+    dtype: np.dtype
+
+    def __init__(self, settings: tuple):
+        shape_size, num_rows, num_cols, shape_set = settings
+        self.settings = tuple(settings)
+        self.num_rows = num_rows + int(shape_size / 2) + 1
+        self.num_cols = num_cols
+        limit = np.iinfo(np.int16).max - shape_size
+        assert self.num_rows <= limit and num_cols <= limit, \
+            'grids over %d cells tall or wide cannot be recorded' % limit
+        self.names = tuple(data.SHAPES[shape_size][shape_set].keys())
+        self.codes = {name: code for code, name in enumerate(self.names)}
+        self.codes[data.SHAPE_EMPTY_NAME] = EMPTY
+        self.dtype = record_dtype(shape_size, self.num_rows, num_cols)
+
+    def board_bytes(self, game: Game):
+        bits = 0
+        cols = self.num_cols
+        if game.bitboard is not None:
+            pad = game.bitboard.pad
+            mask = (1 << cols) - 1
+            for y in range(self.num_rows):
+                if game.row_fill[y]:
+                    bits |= ((game.bitboard.rows[y + pad] >> pad) & mask) << (y * cols)
+        else:
+            for y, row in enumerate(game.grid):
+                if game.row_fill[y]:
+                    for x, cell in enumerate(row):
+                        if not cell.is_empty():
+                            bits |= 1 << (y * cols + x)
+        return bits.to_bytes(self.dtype['board'].shape[0], 'little')
+
+    def encode(self, game: Game, record: np.void):
+        """
+        writes the state of game into record.
+        """
+        record['board'] = np.frombuffer(self.board_bytes(game), np.uint8)
+        record['curr'] = self.codes[game.curr_shape.name]
+        record['next'] = self.codes[game.next_shape.name]
+        record['stockpile'] = [self.codes[name] for name in game.stockpile]
+        record['x'] = game.pos.x
+        record['y'] = game.pos.y
+        record['rot'] = game.rot
+
+    def meta(self):
+        return {
+            'settings': list(self.settings),
+            'num_rows': self.num_rows,
+            'num_cols': self.num_cols,
+            'names': list(self.names),
+            'actions': list(data.ACTIONS),
+        }
+
+
+class Buffer:
+    """
+    A growable array of records in memory.
+    Call record() before performing an action,
+    and reward() once its outcome is known.
+    """
+    encoder: Encoder
+    records: np.ndarray
+    count: int = 0
+
+    def __init__(self, encoder: Encoder, capacity: int = BUFFER_LEN):
+        self.encoder = encoder
+        self.records = np.zeros(capacity, encoder.dtype)
+        self.count = 0
+
+    def record(self, game: Game, action: str, slot: int = 0):
+        if self.count == len(self.records):
+            self.make_room()
+        record = self.records[self.count]
+        self.encoder.encode(game, record)
+        record['action'] = data.ACTIONS.index(action)
+        record['slot'] = slot
+        record['reward'] = 0
+        self.count += 1
+
+    def reward(self, value: int):
+        self.records[self.count - 1]['reward'] = value
+
+    def make_room(self):
+        self.records = np.concatenate((self.records, np.zeros_like(self.records)))
+
+    def take(self):
+        """
+        returns the records so far, and empties the buffer.
+        """
+        records = self.records[:self.count].copy()
+        self.count = 0
+        return records
+
+
+def _header(dtype: np.dtype, count: int):
+    """
+    returns a .npy version 1.0 header of exactly HEADER_LEN
+    bytes, so that it can be rewritten in place once the
+    number of records in a shard is known.
+    """
+    body = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(dtype), count
+    )
+    body_len = HEADER_LEN - 10
+    assert len(body) < body_len
+    body = body.ljust(body_len - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', body_len) + body.encode('latin1')
+
+
+class Recorder(Buffer):
+    """
+    Appends records to a series of .npy shards named
+    <prefix>-00000.npy, <prefix>-00001.npy, ... that
+    can be opened with np.load(path, mmap_mode='r').
+    The settings and shape names are written to
+    <prefix>.json. Use as a context manager, or
+    call close() when done.
+
+    Each shard is preallocated to shard_bytes and
+    written through a memory map. On closing it, its
+    header is rewritten with the number of records,
+    and the unused space is truncated away.
+    """
+    prefix: str
+    capacity: int           # records per shard
+    shard_index: int = -1
+    shard_count: int = 0    # records written to the current shard
+    file = None
+    shard: np.memmap = None
+
+    def __init__(self, prefix: str, settings: tuple, shard_bytes: int = SHARD_BYTES):
+        super().__init__(Encoder(settings))
+        self.prefix = prefix
+        self.capacity = (shard_bytes - HEADER_LEN) // self.encoder.dtype.itemsize
+        assert self.capacity > 0
+        with open(prefix + '.json', 'w') as f:
+            json.dump(self.encoder.meta(), f, indent=2)
+
+    def make_room(self):
+        self.extend(self.take())
+
+    def extend(self, records: np.ndarray):
+        """
+        writes records, such as those from a Buffer.
+        """
+        assert records.dtype == self.encoder.dtype
+        start = 0
+        while start < len(records):
+            if self.shard is None or self.shard_count == self.capacity:
+                self.next_shard()
+            stop = start + min(len(records) - start, self.capacity - self.shard_count)
+            self.shard[self.shard_count:self.shard_count + stop - start] = records[start:stop]
+            self.shard_count += stop - start
+            start = stop
+
+    def next_shard(self):
+        self.close_shard()
+        self.shard_index += 1
+        self.file = open('%s-%05d.npy' % (self.prefix, self.shard_index), 'w+b')
+        self.file.write(_header(self.encoder.dtype, self.capacity))
+        self.file.truncate(HEADER_LEN + self.capacity * self.encoder.dtype.itemsize)
+        self.shard = np.memmap(self.file, self.encoder.dtype, 'r+',
+                               offset=HEADER_LEN, shape=(self.capacity, ))
+        self.shard_count = 0
+
+    def close_shard(self):
+        if self.shard is None:
+            return
+        self.shard.flush()
+        self.shard = None
+        self.file.seek(0)
+        self.file.write(_header(self.encoder.dtype, self.shard_count))
+        self.file.truncate(HEADER_LEN + self.shard_count * self.encoder.dtype.itemsize)
+        self.file.close()
+        self.file = None
+
+    def close(self):
+        if self.count:
+            self.extend(self.take())
+        self.close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_meta(prefix: str):
+    with open(prefix + '.json') as f:
+        return json.load(f)
+
+
+def open_shards(prefix: str):
+    """
+    returns a read-only memory map of each
+    shard written with prefix, in order.
+    """
+    paths = sorted(glob.glob(glob.escape(prefix) + '-[0-9][0-9][0-9][0-9][0-9].npy'))
+    return [np.load(path, mmap_mode='r') for path in paths]
+
+
+def sample(shards: [np.ndarray, ], n: int, rng: np.random.Generator = None):
+    """
+    returns n records drawn uniformly with replacement
+    from all of the shards, reading only those records.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    sizes = np.array([len(shard) for shard in shards])
+    picks = np.sort(rng.integers(0, sizes.sum(), n))
+    bounds = np.concatenate(([0], np.cumsum(sizes)))
+    parts = []
+    for i, shard in enumerate(shards):
+        lo, hi = np.searchsorted(picks, bounds[i:i + 2])
+        if hi > lo:
+            parts.append(shard[picks[lo:hi] - bounds[i]])
+    records = np.concatenate(parts)
+    return records[rng.permutation(n)]
+
+
+def unpack_boards(records: np.ndarray, meta: dict):
+    """
+    returns a (len(records), num_rows, num_cols) bool array
+    of the boards in records, with row 0 at the bottom.
+    """
+    rows = meta['num_rows']
+    cols = meta['num_cols']
+    bits = np.unpackbits(records['board'], axis=1, bitorder='little')
+    return bits[:, :rows * cols].reshape(-1, rows, cols).astype(bool)
@@ -0,0 +1,692 @@
+import random
+
+import data
+import zobrist
+from bitboard import BitBoard
+from shapes import *
+
+
+class Cell:
+    """
+    An entry in a Game's grid field.
+    Represents a shape's key, which
+    can be used to get a color value.
+    """
+    key: str
+
+    def __init__(self, key: str = data.CELL_EMPTY_KEY):
+        self.key = key
+
+    def clear(self):
+        self.key = data.CELL_EMPTY_KEY
+
+    def is_empty(self):
+        return self.key is data.CELL_EMPTY_KEY
+
+    def __str__(self):
+        return ' ' + self.key
+
+
+RNG_CHECKPOINT_DRAWS = 64  # draws between the rng states kept for snapshots
+
+
+class Snapshot:
+    """
+    The state of a Game at one moment. see Game.snapshot.
+    Rows are immutable tuples of keys, shared with the
+    Game and its other snapshots until they change.
+    """
+    shape_set: str
+    rows: ((str, ), )       # the keys of each row of the grid
+    heights: (int, )
+    curr_shape: Shape
+    next_shape: Shape
+    stockpile: (str, )
+    prev_shapes: (str, )
+    rng_checkpoint: tuple   # (rng state, draws) shared with other snapshots
+    draws: int
+    sequence_pos: int
+    pos: (int, int)
+    rot: int
+    lines: int
+    score: int
+    combo: int
+    over: bool
+
+
+class Game:
+    """
+    Representation Invariant:
+    any entry in the list 'grid' must be a tuple
+    of length num_cols- an initializing parameter.
+    row_fill[y] must be the number of non-empty
+    Cells in grid[y]. every Cell in column x at or
+    above row heights[x] must be empty.
+    """
+    shape_size: int             # > 0. determines many of the following qualities
+    dmn: Pair                   # stores the number of rows in y and cols in x
+    grid: [(Cell, ), ]          # list of rows of shape keys (Cells). rows move when lines clear
+    row_fill: [int, ]           # number of occupied cells in each row of grid
+    heights: [int, ]            # skyline: 1 + the highest occupied row of each column, or 0
+    ceil_len: int = 0           # RI: must be < len(self.grid)
+    zobrist: ((int, ), )        # random key of each cell, indexed [y][x]
+    row_hashes: [int, ]         # xor of the keys of the occupied cells in each row
+    hash: int = 0               # xor of row_hashes: the Zobrist hash of the grid's occupancy
+    row_keys: [(str, ), ]       # immutable copy of each row's keys for snapshots, or None if stale
+    empty_row: (str, )          # row_keys entry shared by every empty row
+
+    lines: int = 0              # number of lines cleared in total
+    score: int = 0              # for player (indicates skill?)
+    combo: int = 0              # streak of clearing <shape_size> lines with one shape
+    over: bool = False          # True once the next shape had no room to spawn
+    locked_rows: set = frozenset()  # rows changed by the last lock: written by the shape or by clears
+
+    shape_set: str              # a key for this shape_size to a set of shapes
+    next_shape: Shape = None    # for player (helpful to them)
+    curr_shape: Shape = None    # current shape falling & being controlled by the player
+    prev_shapes: data.ShapeHistory  # bounded queue of previous shapes' name fields
+    seed: int                   # seed of rng
+    rng: random.Random          # draws every shape of this game
+    draws: int = 0              # number of shapes drawn from rng
+    rng_checkpoint: tuple = None  # (rng state, draws) for snapshots. None if rng was changed directly
+    sequence = None             # optional sequence of the names of the shapes to draw
+    sequence_pos: int = 0       # index in sequence of the next name to draw
+    recorder = None             # optional. gets record(action, slot) after each step, record(None) after each tick
+    stockpile: [str, ]          # shape keys. RI: length should not exceed Data.STOCKPILE_CAPACITY
+    pos: Pair                   # position of the current shape's pivot
+    rot: int                    # {0:down=south, 1:down=east, 2:down=north, 3:down=west}
+
+    bitboard: BitBoard = None   # optional occupancy mirror of grid for collision checks
+
+    def __init__(self,
+                 shape_size: int,
+                 num_rows: int,
+                 num_cols: int,
+                 shape_set: str,
+                 bitboard: bool = False,
+                 seed: int = None
+                 ):
+        """
+        if bitboard is True, collision checks are done
+        against a BitBoard kept in sync with the grid
+        instead of by walking Cell objects.
+        games with the same seed get the same shapes.
+        if no seed is given, a random one is chosen.
+        """
+        if seed is None:
+            seed = random.getrandbits(63)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.draws = 0
+        self.rng_checkpoint = None
+        self.shape_size = shape_size
+        self.dmn = Pair(num_cols, num_rows)
+        grid = []
+        for r in range(num_rows + int(self.shape_size / 2) + 1):
+            grid.append(tuple(Cell() for c in range(num_cols)))
+        self.grid = grid
+        self.row_fill = [0] * len(grid)
+        self.heights = [0] * num_cols
+        self.zobrist = zobrist.keys(len(grid), num_cols)
+        self.row_hashes = [0] * len(grid)
+        self.hash = 0
+        self.empty_row = (data.CELL_EMPTY_KEY, ) * num_cols
+        self.row_keys = [self.empty_row] * len(grid)
+        if bitboard:
+            self.bitboard = BitBoard(len(grid), num_cols, shape_size)
+
+        # spawn the first shape
+        self.curr_shape = None
+        self.shape_set = None
+        self.change_shape_set(shape_set)
+
+    def stockpile_access(self, slot: int):
+        """
+        switches the current shape with another
+        being stored away. select by index, <slot>
+
+        requires that slot is in
+        range(data.STOCKPILE_CAPACITY)
+
+        return True if the stockpile at slot
+        was empty, and new shape needs to be spawned.
+        """
+        slot_copy: str = self.stockpile[slot]
+        if slot_copy is data.SHAPE_EMPTY_NAME:
+            self.stockpile[slot] = self.curr_shape.name
+            return True
+
+        slot_shape = data.SHAPES[self.shape_size][self.shape_set][slot_copy]
+
+        # check if the stock shape has no room to be swapped-in:
+        if not self.shape_fits(slot_shape, 0, self.pos.x, self.pos.y):
+            return False
+
+        self.stockpile[slot] = self.curr_shape.name
+        self.curr_shape = slot_shape
+        self.rot = 0
+        return False
+
+    def handle_clears(self):
+        """
+        makes lines above cleared lines fall.
+        updates the player's score.
+
+        all full lines are found in one scan, and the
+        surviving rows are moved down in a single sweep.
+        returns the set of indices of rows whose
+        contents changed, which is empty if no
+        lines were cleared.
+        """
+        ceiling = self.dmn.y - self.ceil_len
+        grid = self.grid
+        fill = self.row_fill
+        width = self.dmn.x
+        full_lines = [y for y in range(ceiling) if fill[y] == width]
+        lines_cleared = len(full_lines)
+
+        changed = set()
+        if full_lines:
+            lowest_line = full_lines[0]
+            old_fill = fill[lowest_line:ceiling]
+            cleared_rows = [grid[y] for y in full_lines]
+            dst = lowest_line
+            for src in range(lowest_line, ceiling):
+                if fill[src] != width:
+                    grid[dst] = grid[src]
+                    fill[dst] = fill[src]
+                    dst += 1
+            # recycle the cleared rows at the top
+            for row in cleared_rows:
+                for cell in row:
+                    cell.clear()
+                grid[dst] = row
+                fill[dst] = 0
+                dst += 1
+            if self.bitboard is not None:
+                self.bitboard.remove_rows(full_lines, ceiling)
+            for y in range(lowest_line, ceiling):
+                if fill[y] or old_fill[y - lowest_line]:
+                    changed.add(y)
+            self.lower_heights(full_lines, ceiling)
+            for y in changed:
+                self.rehash_row(y)
+                self.row_keys[y] = None
+        self.lines += lines_cleared
+
+        if lines_cleared is not self.shape_size:
+            self.combo = 0
+        score = data.calculate_score(lines_cleared + self.combo)
+        # TODO: make score higher if period is shorter
+        self.score += score
+        if lines_cleared is self.shape_size:
+            self.combo += 1
+
+        return changed
+
+    def spawn_next_shape(self):
+        """
+        called once during initialization, and
+        always at the end of set_curr_shape().
+        Also called when changing shape_set
+
+        Returns True if there is no room for
+        the next shape to spawn and the host
+        gui must end the game.
+        """
+        self.rot = 0
+        # get the pivot position for the next tile to spawn in
+        shape_ceil = self.next_shape.extremes[self.rot][2]
+        spawn_y = self.dmn.y - (1 + self.ceil_len + shape_ceil)
+        self.pos = Pair(int(self.dmn.x / 2), spawn_y)
+
+        # check if the next tile has room to spawn
+        if not self.shape_fits(self.next_shape, self.rot, self.pos.x, self.pos.y):
+            self.over = True
+            return True
+
+        # didn't lose; pass on next shape to current shape
+        if self.curr_shape is not None:  # for the __init__ call
+            self.prev_shapes.append(self.curr_shape.name)
+        self.curr_shape = self.next_shape
+        self.next_shape = self.draw_shape()
+        return False
+
+    def draw_shape(self):
+        """
+        returns the next name from sequence as a Shape,
+        or once it is used up (or if there is none), a
+        random shape weighted by the history of shapes.
+        """
+        sequence = self.sequence
+        if sequence is not None and self.sequence_pos < len(sequence):
+            name = sequence[self.sequence_pos]
+            self.sequence_pos += 1
+            return data.SHAPES[self.shape_size][self.shape_set][name]
+        self.draws += 1
+        return self.prev_shapes.draw(self.rng)
+
+    def translate(self, direction: int = 0):
+        """
+        Returns True if a translation could
+        not be done: ie. if translating down,
+        the host gui must call self.game.set_curr_shape()
+        """
+        pos = self.pos
+        x = pos.x + SHIFT_X[direction]
+        y = pos.y + SHIFT_Y[direction]
+        if self.bitboard is not None:
+            if not self.bitboard.free(self.curr_shape.edge_masks[self.rot][direction], pos.x, pos.y):
+                return True
+        elif not self.cells_free(self.curr_shape.edges[self.rot][direction], pos.x, pos.y):
+            return True  # was 'direction is 0'
+
+        # translation is valid; execute it
+        pos.x = x
+        pos.y = y
+        return False
+
+    def rotate(self, angle: int):
+        """
+        returns True and performs the
+        rotation if it is allowed
+        """
+        rot = (self.rot + angle) % 4
+        if self.bitboard is not None:
+            if not self.bitboard.free(
+                    self.curr_shape.rot_delta_masks[self.rot][angle % 4], self.pos.x, self.pos.y):
+                return False
+        elif not self.cells_free(
+                self.curr_shape.rot_deltas[self.rot][angle % 4], self.pos.x, self.pos.y):
+            return False
+
+        self.rot = rot
+        return True
+
+    def place_shape(self):
+        """
+        writes the current shape into the grid
+        at its current position and rotation.
+        """
+        key = self.curr_shape.name
+        x = self.pos.x
+        y = self.pos.y
+        heights = self.heights
+        for dx, dy in self.curr_shape.offsets[self.rot]:
+            self.grid[y + dy][x + dx].key = key
+            self.row_fill[y + dy] += 1
+            self.row_keys[y + dy] = None
+            if heights[x + dx] <= y + dy:
+                heights[x + dx] = y + dy + 1
+            cell_key = self.zobrist[y + dy][x + dx]
+            self.row_hashes[y + dy] ^= cell_key
+            self.hash ^= cell_key
+        if self.bitboard is not None:
+            self.bitboard.place(self.curr_shape, self.rot, self.pos.x, self.pos.y)
+
+    def lock_shape(self):
+        """
+        writes the current shape into the grid and
+        clears any lines it completed. returns the
+        set of rows changed by clearing lines.
+        locked_rows also gets the rows it was written to.
+
+        the caller must then call spawn_next_shape().
+        """
+        y = self.pos.y
+        written = {y + dy for dx, dy in self.curr_shape.offsets[self.rot]}
+        self.place_shape()
+        changed = self.handle_clears()
+        self.locked_rows = changed | written
+        return changed
+
+    def tick(self):
+        """
+        one step of gravity: makes the current shape
+        fall by one row, or locks it in place and
+        spawns the next shape if it cannot fall.
+
+        returns True if the current shape was locked.
+        """
+        locked = self.fall()
+        if self.recorder is not None:
+            self.recorder.record(None)
+        return locked
+
+    def fall(self):
+        if self.over:
+            return False
+        if self.translate():
+            self.lock_shape()
+            self.spawn_next_shape()
+            return True
+        return False
+
+    def step(self, action: str, slot: int = 0):
+        """
+        performs a player action, where action is one
+        of the constants in data.ACTIONS. slot selects
+        the stockpile slot for data.STOCKPILE.
+        data.PAUSE has no effect on a headless game.
+
+        returns True if the current shape was locked.
+        """
+        locked = self.apply(action, slot)
+        if self.recorder is not None:
+            self.recorder.record(action, slot)
+        return locked
+
+    def apply(self, action: str, slot: int = 0):
+        assert action in data.ACTIONS
+        if action == data.RESTART:
+            self.restart()
+            return False
+        if self.over:
+            return False
+
+        if action == data.RCC:
+            self.rotate(3)
+        elif action == data.RCW:
+            self.rotate(1)
+        elif action == data.TSD:
+            return self.fall()
+        elif action == data.THD:
+            self.hard_drop()
+            self.lock_shape()
+            self.spawn_next_shape()
+            return True
+        elif action == data.TSL:
+            self.translate(3)
+        elif action == data.THL:
+            while not self.translate(3):
+                pass
+        elif action == data.TSR:
+            self.translate(1)
+        elif action == data.THR:
+            while not self.translate(1):
+                pass
+        elif action == data.STOCKPILE:
+            if self.stockpile_access(slot):
+                self.spawn_next_shape()
+        return False
+
+    def lower_heights(self, lines: [int, ], ceiling: int):
+        """
+        updates the skyline after the rows in lines
+        (sorted ascending) have been removed and the
+        rows between them and the ceiling have fallen.
+        """
+        grid = self.grid
+        heights = self.heights
+        for x in range(self.dmn.x):
+            h = heights[x]
+            if h == 0 or h > ceiling:
+                continue  # empty, or topped by cells that don't fall
+            h -= sum(1 for y in lines if y < h)
+            while h > 0 and grid[h - 1][x].is_empty():
+                h -= 1
+            heights[x] = h
+
+    def rehash_row(self, y: int):
+        """
+        recomputes the hash of row y from its
+        cells, and updates the grid's hash.
+        """
+        row_hash = 0
+        keys = self.zobrist[y]
+        for x, cell in enumerate(self.grid[y]):
+            if cell.key is not data.CELL_EMPTY_KEY:
+                row_hash ^= keys[x]
+        self.hash ^= self.row_hashes[y] ^ row_hash
+        self.row_hashes[y] = row_hash
+
+    def drop_distance(self):
+        """
+        returns the number of rows that the current
+        shape can fall from its current position.
+
+        uses the skyline, so this is O(shape width)
+        unless the shape is tucked under an overhang.
+        """
+        x = self.pos.x
+        y = self.pos.y
+        distance = None
+        for dx, dy in self.curr_shape.bottoms[self.rot]:
+            gap = y + dy - self.heights[x + dx]
+            if gap < 0:
+                # below the skyline. step down instead
+                distance = 0
+                while self.shape_fits(self.curr_shape, self.rot, x, y - distance - 1):
+                    distance += 1
+                return distance
+            if distance is None or gap < distance:
+                distance = gap
+        return distance
+
+    def hard_drop(self):
+        """
+        moves the current shape down as far as it
+        can go. returns the number of rows it fell.
+        the host gui must then call set_curr_shape()
+        """
+        distance = self.drop_distance()
+        self.pos.y -= distance
+        return distance
+
+    def restart(self):
+        self.lines = 0
+        self.combo = 0
+        self.over = False
+        self.score = data.calculate_score(self.lines)
+
+        # TODO: add a HIGH_SCORES dict to data?
+        #  would be cool if it saved by player name too.
+
+        for line_num in range(len(self.grid)):
+            for cell in self.grid[line_num]:
+                cell.clear()
+            self.row_fill[line_num] = 0
+        for x in range(self.dmn.x):
+            self.heights[x] = 0
+        for line_num in range(len(self.grid)):
+            self.row_hashes[line_num] = 0
+            self.row_keys[line_num] = self.empty_row
+        self.hash = 0
+        if self.bitboard is not None:
+            self.bitboard.clear_rows(0, len(self.grid))
+
+        for slot in range(self.shape_size):
+            self.stockpile[slot] = data.SHAPE_EMPTY_NAME
+
+        self.prev_shapes.clear()
+        self.curr_shape = None
+        self.next_shape = self.draw_shape()
+        self.spawn_next_shape()
+
+    def load_cells(self, keys: [[str, ], ]):
+        """
+        sets the key of every cell in the grid, where
+        keys[y][x] is the key for grid[y][x], and rebuilds
+        row_fill, heights, the hashes and the bitboard.
+        does not change the shapes, score or stockpile.
+        """
+        assert len(keys) == len(self.grid)
+        if self.bitboard is not None:
+            self.bitboard.clear_rows(0, len(self.grid))
+        for x in range(self.dmn.x):
+            self.heights[x] = 0
+        self.hash = 0
+        for y, row in enumerate(self.grid):
+            assert len(keys[y]) == len(row)
+            fill = 0
+            for x, cell in enumerate(row):
+                if keys[y][x] == data.CELL_EMPTY_KEY:
+                    cell.key = data.CELL_EMPTY_KEY
+                    continue
+                cell.key = keys[y][x]
+                fill += 1
+                self.heights[x] = y + 1
+                if self.bitboard is not None:
+                    self.bitboard.set_cell(x, y, True)
+            self.row_fill[y] = fill
+            self.row_hashes[y] = 0
+            self.rehash_row(y)
+            self.row_keys[y] = None
+
+    def snapshot(self):
+        """
+        returns a Snapshot of the game for restore().
+        rows that have not changed since the last snapshot
+        are shared with it, so taking one is O(rows), and
+        only allocates a tuple for each row that changed.
+        the rng's state is shared too: snapshots keep the
+        last checkpoint of it and the number of draws since.
+        """
+        grid = self.grid
+        row_keys = self.row_keys
+        for y, keys in enumerate(row_keys):
+            if keys is None:
+                if self.row_fill[y]:
+                    row_keys[y] = tuple(cell.key for cell in grid[y])
+                else:
+                    row_keys[y] = self.empty_row
+        snapshot = Snapshot()
+        snapshot.shape_set = self.shape_set
+        snapshot.rows = tuple(row_keys)
+        snapshot.heights = tuple(self.heights)
+        snapshot.curr_shape = self.curr_shape
+        snapshot.next_shape = self.next_shape
+        snapshot.stockpile = tuple(self.stockpile)
+        snapshot.prev_shapes = tuple(self.prev_shapes)
+        checkpoint = self.rng_checkpoint
+        if checkpoint is None or self.draws - checkpoint[1] >= RNG_CHECKPOINT_DRAWS:
+            checkpoint = self.rng_checkpoint = (self.rng.getstate(), self.draws)
+        snapshot.rng_checkpoint = checkpoint
+        snapshot.draws = self.draws
+        snapshot.sequence_pos = self.sequence_pos
+        snapshot.pos = (self.pos.x, self.pos.y)
+        snapshot.rot = self.rot
+        snapshot.lines = self.lines
+        snapshot.score = self.score
+        snapshot.combo = self.combo
+        snapshot.over = self.over
+        return snapshot
+
+    def restore(self, snapshot: Snapshot):
+        """
+        puts the game back in the state of a snapshot.
+        only the rows that differ from it are rewritten.
+        returns the set of indices of rows whose contents
+        changed. restoring is not seen by a recorder.
+        """
+        self.snapshot()  # so that unchanged rows are the same tuples
+        changed = set()
+        bitboard = self.bitboard
+        for y, keys in enumerate(snapshot.rows):
+            if keys is self.row_keys[y]:
+                continue
+            changed.add(y)
+            fill = 0
+            if bitboard is not None:
+                bitboard.clear_rows(y, y + 1)
+            for x, cell in enumerate(self.grid[y]):
+                cell.key = keys[x]
+                if keys[x] is not data.CELL_EMPTY_KEY:
+                    fill += 1
+                    if bitboard is not None:
+                        bitboard.set_cell(x, y, True)
+            self.row_fill[y] = fill
+            self.row_keys[y] = keys
+            self.rehash_row(y)
+        self.heights[:] = snapshot.heights
+
+        if snapshot.shape_set != self.shape_set:
+            self.shape_set = snapshot.shape_set
+            self.prev_shapes = data.ShapeHistory(self.shape_size, self.shape_set)
+        self.prev_shapes.clear()
+        self.prev_shapes.extend(snapshot.prev_shapes)
+        self.curr_shape = snapshot.curr_shape
+        self.next_shape = snapshot.next_shape
+        self.stockpile[:] = snapshot.stockpile
+        # each draw takes one number from rng
+        state, draws = snapshot.rng_checkpoint
+        self.rng.setstate(state)
+        for _ in range(snapshot.draws - draws):
+            self.rng.random()
+        self.draws = snapshot.draws
+        self.rng_checkpoint = snapshot.rng_checkpoint
+        self.sequence_pos = snapshot.sequence_pos
+        self.pos = Pair(*snapshot.pos)
+        self.rot = snapshot.rot
+        self.lines = snapshot.lines
+        self.score = snapshot.score
+        self.combo = snapshot.combo
+        self.over = snapshot.over
+        return changed
+
+    def change_shape_set(self, shape_set: str):
+        not_compatible: bool = False
+        if self.shape_set is not None:
+            # Check to see if the key sets (shape names) are the same
+            for key in data.SHAPES[self.shape_size][self.shape_set].keys():
+                if key not in data.SHAPES[self.shape_size][shape_set].keys():
+                    not_compatible = True
+                    break
+        else:
+            not_compatible = True
+
+        self.shape_set = shape_set
+        history = data.ShapeHistory(self.shape_size, shape_set)
+        if not_compatible:
+            # Clear previous shape data and stockpile
+            self.stockpile = []
+            for i in range(self.shape_size):
+                self.stockpile.append(data.SHAPE_EMPTY_NAME)
+        else:
+            # keep the history, drawing from the new shapes
+            history.extend(self.prev_shapes)
+        self.prev_shapes = history
+
+        self.next_shape = self.draw_shape()
+        self.spawn_next_shape()
+
+    def shape_fits(self, shape: Shape, rot: int, x: int, y: int):
+        """
+        returns True if shape in rotation rot with its
+        pivot at (x, y) only covers empty cells.
+        """
+        if self.bitboard is not None:
+            return self.bitboard.fits(shape, rot, x, y)
+        return self.cells_free(shape.offsets[rot], x, y)
+
+    def cells_free(self, offsets: ((int, int), ), x: int, y: int):
+        """
+        returns True if every cell at an offset
+        from (x, y) is inside the walls and empty.
+        """
+        width = self.dmn.x
+        grid = self.grid
+        for dx, dy in offsets:
+            tx = x + dx
+            ty = y + dy
+            if tx < 0 or tx >= width or ty < 0:
+                return False
+            if grid[ty][tx].key is not data.CELL_EMPTY_KEY:
+                return False
+        return True
+
+    def cell_at_tile(self, p: Pair):
+        x = self.pos.x + p.x
+        y = self.pos.y + p.y
+        if x < 0 or x >= self.dmn.x or y < 0:  # took out 'or y >= self.dmn.y'
+            return Cell(data.CELL_WALL_KEY)
+        else:
+            return self.grid[y][x]
+
+    def __str__(self):
+        to_string = ''
+        for line in reversed(self.grid):
+            for cell in line:
+                to_string += str(cell)
+            to_string += '\n'
+        return to_string
@@ -0,0 +1,126 @@
+import numpy as np
+
+from engine import Game
+
+"""
+The features returned for each board. All are integers.
+heights: (num_cols, ) 1 + the highest filled row of each column, or 0
+height: sum of the heights
+holes: number of empty cells below the height of their column
+wells: sum over columns of how far the column is below its lower
+       neighbour, where the walls are as high as the board
+row_transitions: number of changes between filled and empty cells
+       along each row below the highest column, counting the
+       walls as filled
+bumpiness: sum of the differences in height of neighbouring columns
+"""
+FEATURES = ('heights', 'height', 'holes', 'wells', 'row_transitions', 'bumpiness')
+
+
+def board_array(game: Game):
+    """
+    returns a (rows, cols) bool array of which of
+    the game's cells are filled, with row 0 at the
+    bottom as in Game.grid, including hidden rows.
+    """
+    return np.array([[not cell.is_empty() for cell in row] for row in game.grid])
+
+
+def stack(games: [Game, ]):
+    """
+    returns a (len(games), rows, cols) batch for extract.
+    """
+    return np.stack([board_array(game) for game in games])
+
+
+def extract(boards: np.ndarray):
+    """
+    returns a dict of FEATURES for a batch of boards, each
+    an array with one entry (or row, for heights) per board.
+
+    boards is a (num_boards, rows, cols) array where any
+    non-zero entry is a filled cell, and row 0 is at the
+    bottom, such as from stack() or BatchGame.boards.
+    """
+    filled = np.asarray(boards) != 0
+    num_boards, rows, cols = filled.shape
+
+    # the first filled cell looking down from the top of each column
+    top = rows - filled[:, ::-1, :].argmax(axis=1)
+    heights = np.where(filled.any(axis=1), top, 0).astype(np.int32)
+    holes = (heights - filled.sum(axis=1, dtype=np.int32)).sum(axis=1)
+    bumpiness = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+
+    walls = np.full((num_boards, 1), rows, np.int32)
+    padded = np.concatenate((walls, heights, walls), axis=1)
+    lower = np.minimum(padded[:, :-2], padded[:, 2:])
+    wells = np.maximum(lower - heights, 0).sum(axis=1)
+
+    changes = (filled[:, :, 1:] != filled[:, :, :-1]).sum(axis=2, dtype=np.int32)
+    changes += ~filled[:, :, 0]
+    changes += ~filled[:, :, -1]
+    below = np.arange(rows)[None, :] < heights.max(axis=1)[:, None]
+    row_transitions = (changes * below).sum(axis=1)
+
+    return {
+        'heights': heights,
+        'height': heights.sum(axis=1),
+        'holes': holes,
+        'wells': wells,
+        'row_transitions': row_transitions,
+        'bumpiness': bumpiness,
+    }
+
+
+def reference(game: Game):
+    """
+    returns the same features as extract for a single
+    game, computed by walking the Cells of its grid.
+    slow, but simple enough to check extract against.
+    """
+    rows = len(game.grid)
+    cols = game.dmn.x
+
+    def filled(x, y):
+        return not game.grid[y][x].is_empty()
+
+    heights = []
+    holes = 0
+    for x in range(cols):
+        height = 0
+        for y in range(rows):
+            if filled(x, y):
+                height = y + 1
+        heights.append(height)
+        for y in range(height):
+            if not filled(x, y):
+                holes += 1
+
+    wells = 0
+    for x in range(cols):
+        left = heights[x - 1] if x > 0 else rows
+        right = heights[x + 1] if x < cols - 1 else rows
+        wells += max(min(left, right) - heights[x], 0)
+
+    row_transitions = 0
+    for y in range(max(heights)):
+        prev = True  # the left wall
+        for x in range(cols):
+            if filled(x, y) != prev:
+                row_transitions += 1
+            prev = filled(x, y)
+        if not prev:  # the right wall
+            row_transitions += 1
+
+    bumpiness = 0
+    for x in range(cols - 1):
+        bumpiness += abs(heights[x] - heights[x + 1])
+
+    return {
+        'heights': heights,
+        'height': sum(heights),
+        'holes': holes,
+        'wells': wells,
+        'row_transitions': row_transitions,
+        'bumpiness': bumpiness,
+    }
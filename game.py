@@ -1,274 +1,13 @@
+import os
+import sys
+import time
+from collections import deque
 from tkinter import Tk, Frame, Canvas, Label, Menu, StringVar, IntVar, messagebox
 
 import data
-from shapes import *
-
-
-class Cell:
-    """
-    An entry in a Game's grid field.
-    Represents a shape's key, which
-    can be used to get a color value.
-    """
-    canvas_id: int
-    key: str
-    upstairs_neighbor = None  # Another Cell object
-
-    def __init__(self, key: str = data.CELL_EMPTY_KEY):
-        self.key = key
-
-    def set_upstairs_neighbor(self, upstairs_neighbor=None):
-        if upstairs_neighbor is not None:
-            assert isinstance(upstairs_neighbor, Cell)
-        self.upstairs_neighbor = upstairs_neighbor
-
-    def catch_falling(self):
-        """recursive"""
-        if self.upstairs_neighbor is None:
-            self.clear()
-        else:
-            self.key = self.upstairs_neighbor.key
-            self.upstairs_neighbor.catch_falling()
-
-    def clear(self):
-        self.key = data.CELL_EMPTY_KEY
-
-    def is_empty(self):
-        return self.key is data.CELL_EMPTY_KEY
-
-    def __str__(self):
-        return ' ' + self.key
-
-
-class Game:
-    """
-    Representation Invariant:
-    any entry in the tuple 'grid' must be a list
-    of length num_cols- an initializing parameter.
-    """
-    shape_size: int             # > 0. determines many of the following qualities
-    dmn: Pair                   # stores the number of rows in y and cols in x
-    grid: ([Cell, ], )          # tuple of lists of shape keys (Cells)
-    ceil_len: int = 0           # RI: must be < len(self.grid)
-
-    lines: int = 0              # number of lines cleared in total
-    score: int = 0              # for player (indicates skill?)
-    combo: int = 0              # streak of clearing <shape_size> lines with one shape
-
-    shape_set: str              # a key for this shape_size to a set of shapes
-    next_shape: Shape = None    # for player (helpful to them)
-    curr_shape: Shape = None    # current shape falling & being controlled by the player
-    prev_shapes: [str, ]        # queue of previous shapes' name fields
-    stockpile: [str, ]          # shape keys. RI: length should not exceed Data.STOCKPILE_CAPACITY
-    pos: Pair                   # position of the current shape's pivot
-    rot: int                    # {0:down=south, 1:down=east, 2:down=north, 3:down=west}
-
-    def __init__(self,
-                 shape_size: int,
-                 num_rows: int,
-                 num_cols: int,
-                 shape_set: str
-                 ):
-        self.shape_size = shape_size
-        self.dmn = Pair(num_cols, num_rows)
-        grid = []
-        for r in range(num_rows + int(self.shape_size / 2) + 1):
-            row = []
-            for c in range(num_cols):
-                cell = Cell()
-                row.append(cell)
-                if r is not 0 and r < num_rows:
-                    grid[r-1][c].set_upstairs_neighbor(cell)
-            grid.append(tuple(row))
-        self.grid = tuple(grid)
-
-        # spawn the first shape
-        self.curr_shape = None
-        self.shape_set = None
-        self.change_shape_set(shape_set)
-
-    def stockpile_access(self, slot: int):
-        """
-        switches the current shape with another
-        being stored away. select by index, <slot>
-
-        requires that slot is in
-        range(data.STOCKPILE_CAPACITY)
-
-        return True if the stockpile at slot
-        was empty, and new shape needs to be spawned.
-        """
-        slot_copy: str = self.stockpile[slot]
-        if slot_copy is data.SHAPE_EMPTY_NAME:
-            self.stockpile[slot] = self.curr_shape.name
-            return True
-
-        slot_shape = data.SHAPES[self.shape_size][self.shape_set][slot_copy]
-
-        # check if the stock shape has no room to be swapped-in:
-        for t in slot_shape.tiles:
-            if not self.cell_at_tile(t.p[0]).is_empty():
-                return False
-
-        self.stockpile[slot] = self.curr_shape.name
-        self.curr_shape = slot_shape
-        self.rot = 0
-        return False
-
-    def handle_clears(self):
-        """
-        makes lines above cleared lines fall.
-        updates the player's score.
-        """
-        lowest_line = None
-
-        lines_cleared = 0
-        y = 0
-        range_ = self.dmn.y - self.ceil_len
-        while y < range_:
-            if any(list(map(Cell.is_empty, self.grid[y]))):
-                y += 1
-                continue
-            lines_cleared += 1
-            range_ -= 1
-            if lowest_line is None:
-                lowest_line = y
-            for cell in self.grid[y]:
-                cell.catch_falling()
-        self.lines += lines_cleared
-
-        if lines_cleared is not self.shape_size:
-            self.combo = 0
-        score = data.calculate_score(lines_cleared + self.combo)
-        # TODO: make score higher if period is shorter
-        self.score += score
-        if lines_cleared is self.shape_size:
-            self.combo += 1
-
-        return lowest_line
-
-    def spawn_next_shape(self):
-        """
-        called once during initialization, and
-        always at the end of set_curr_shape().
-        Also called when changing shape_set
-
-        Returns True if there is no room for
-        the next shape to spawn and the host
-        gui must end the game.
-        """
-        self.rot = 0
-        # get the pivot position for the next tile to spawn in
-        shape_ceil = self.next_shape.extreme(self.rot, 2)
-        spawn_y = self.dmn.y - (1 + self.ceil_len + shape_ceil)
-        self.pos = Pair(int(self.dmn.x / 2), spawn_y)
-
-        # check if the next tile has room to spawn
-        for t in self.next_shape.tiles:
-            if not self.cell_at_tile(t.p[self.rot]).is_empty():
-                return True
-
-        # didn't lose; pass on next shape to current shape
-        if self.curr_shape is not None:  # for the __init__ call
-            self.prev_shapes.append(self.curr_shape.name)
-        if len(self.prev_shapes) >= data.SHAPE_QUEUE_SIZE:
-            self.prev_shapes = self.prev_shapes[1:-1]
-        self.curr_shape = self.next_shape
-        self.next_shape = data.get_random_shape(
-            self.shape_size, self.shape_set, self.prev_shapes
-        )
-        return False
-
-    def translate(self, direction: int = 0):
-        """
-        Returns True if a translation could
-        not be done: ie. if translating down,
-        the host gui must call self.game.set_curr_shape()
-        """
-        angle = (self.rot + direction) % 4
-        for t in self.curr_shape.faces[angle]:
-            t_p: Pair = t.p[self.rot].shift(direction)
-            if not self.cell_at_tile(t_p).is_empty():
-                return True  # was 'direction is 0'
-
-        # translation is valid; execute it
-        self.pos = self.pos.shift(direction)
-        return False
-
-    def rotate(self, angle: int):
-        """
-        returns True and performs the
-        rotation if it is allowed
-        """
-        rot = (self.rot + angle) % 4
-        for t in self.curr_shape.tiles:
-            if not self.cell_at_tile(t.p[rot]).is_empty():
-                return False
-
-        self.rot = rot
-        return True
-
-    def restart(self):
-        self.lines = 0
-        self.combo = 0
-        self.score = data.calculate_score(self.lines)
-
-        # TODO: add a HIGH_SCORES dict to data?
-        #  would be cool if it saved by player name too.
-
-        for line_num in range(self.dmn.y):
-            for cell in self.grid[line_num]:
-                cell.clear()
-
-        for slot in range(self.shape_size):
-            self.stockpile[slot] = data.SHAPE_EMPTY_NAME
-
-        self.prev_shapes = []
-        self.curr_shape = None
-        self.next_shape = data.get_random_shape(
-            self.shape_size, self.shape_set, self.prev_shapes
-        )
-        self.spawn_next_shape()
-
-    def change_shape_set(self, shape_set: str):
-        not_compatible: bool = False
-        if self.shape_set is not None:
-            # Check to see if the key sets (shape names) are the same
-            for key in data.SHAPES[self.shape_size][self.shape_set].keys():
-                if key not in data.SHAPES[self.shape_size][shape_set].keys():
-                    not_compatible = True
-                    break
-        else:
-            not_compatible = True
-
-        self.shape_set = shape_set
-        if not_compatible:
-            # Clear previous shape data and stockpile
-            self.prev_shapes = []
-            self.stockpile = []
-            for i in range(self.shape_size):
-                self.stockpile.append(data.SHAPE_EMPTY_NAME)
-
-        self.next_shape = data.get_random_shape(
-            self.shape_size, self.shape_set, self.prev_shapes
-        )
-        self.spawn_next_shape()
-
-    def cell_at_tile(self, p: Pair):
-        x = self.pos.x + p.x
-        y = self.pos.y + p.y
-        if x < 0 or x >= self.dmn.x or y < 0:  # took out 'or y >= self.dmn.y'
-            return Cell(data.CELL_WALL_KEY)
-        else:
-            return self.grid[y][x]
-
-    def __str__(self):
-        to_string = ''
-        for line in reversed(self.grid):
-            for cell in line:
-                to_string += str(cell)
-            to_string += '\n'
-        return to_string
+import replay
+from engine import Game
+from render import RENDERERS, SpriteCache
 
 
 class ShapeFrame(Frame):
@@ -279,9 +18,9 @@ class ShapeFrame(Frame):
     """
     parent_game = None
     shape_size: int
-    pos: Pair
     canvas: Canvas
-    canvas_ids: tuple   # 2D tuple of canvas item ids
+    image_id: int       # canvas item id of the preview image
+    sprite = None       # the PhotoImage shown, kept so that tk does not delete it
     label: Label
 
     def __init__(self, master: Frame, shape_size: int, cs: dict, name: str):
@@ -290,7 +29,6 @@ class ShapeFrame(Frame):
         assert isinstance(self.parent_game, GameFrame)
 
         self.shape_size = shape_size
-        self.pos = Pair(int(shape_size / 2), int(shape_size / 2))
 
         self.label = Label(self, text=str(name))
         self.label.pack()
@@ -300,34 +38,23 @@ class ShapeFrame(Frame):
             height=(data.canvas_dmn(shape_size) - data.GUI_CELL_PAD),
             width=(data.canvas_dmn(shape_size) - data.GUI_CELL_PAD),
         )
-        canvas_ids = []
-        for y in range(shape_size):
-            row = []
-            for x in range(shape_size):
-                x0 = data.canvas_dmn(x)
-                y0 = data.canvas_dmn(shape_size - 1 - y)
-                canvas_id = canvas.create_rectangle(
-                    x0, y0, x0 + data.GUI_CELL_WID, y0 + data.GUI_CELL_WID,
-                    width=0, fill=cs[data.CELL_EMPTY_KEY]
-                )
-                row.append(canvas_id)
-            canvas_ids.append(tuple(row))
-        self.canvas_ids = tuple(canvas_ids)
+        self.image_id = canvas.create_image(0, 0, anchor='nw')
         self.canvas = canvas
         canvas.pack()
 
     def redraw_shape(self, name: str):
-        # clear all drawn tiles
-        self.canvas.itemconfigure(
-            'all', fill=self.parent_game.cs[data.CELL_EMPTY_KEY]
+        """
+        shows the cached preview of the shape called name
+        in one call, if it is not already shown.
+        """
+        parent_game = self.parent_game
+        sprite = parent_game.master.sprites.get(
+            self.shape_size, parent_game.shape_set.get(),
+            parent_game.cs_string_var.get(), name
         )
-
-        shape_set = data.SHAPES[self.shape_size][self.parent_game.shape_set.get()]
-        if name is not data.SHAPE_EMPTY_NAME:
-            color = self.parent_game.cs[name]
-            for t in shape_set[name].tiles:
-                canvas_id = self.id_at_tile(t.p[0])
-                self.canvas.itemconfigure(canvas_id, fill=color)
+        if sprite is not self.sprite:
+            self.canvas.itemconfigure(self.image_id, image=sprite)
+            self.sprite = sprite
 
     def set_color_scheme(self):
         cs = self.parent_game.cs
@@ -335,11 +62,6 @@ class ShapeFrame(Frame):
         self.canvas.configure(bg=cs['grid-lines'])
         self.label.configure(bg=cs['bg'], fg=cs['text'])
 
-    def id_at_tile(self, p: Pair):
-        x = self.pos.x + p.x
-        y = self.pos.y + p.y
-        return self.canvas_ids[y][x]
-
 
 class GameFrame(Frame):
     """
@@ -357,7 +79,17 @@ class GameFrame(Frame):
 
     next_shape: ShapeFrame      #
     canvas: Canvas              #
+    renderer: object            # draws the visible Cells. see render.RENDERERS
+    shown: [[str, ], ]          # the key drawn for each visible Cell, indexed [y][x]
+    dirty: set                  # (x, y) of cells whose key may differ from shown
+    shape_cells: frozenset      # visible (x, y) covered by the drawn current shape
+    shape_key: str = None       # key of the drawn current shape
+    flush_after_id = None       # after_idle identifier of the pending flush
+    ghost_ids: tuple            # canvas item ids outlining where the current shape will land
+    ghost: tuple = None         # (x, y, rot, shape name, color) of the drawn ghost outlines
     stockpile: [ShapeFrame, ]   #
+    undo_stack: deque           # Game snapshots taken as each shape spawned. bounded
+    recorder: replay.Recorder = None  # log of the game since it started. closed once it can't follow it
 
     un_paused: bool             #
     score: StringVar            #
@@ -365,10 +97,10 @@ class GameFrame(Frame):
     period: float               #
     gravity_after_id = None     # Alarm identifier for after_cancel()
 
-    def configure_canvas(self, grid_frame: Frame):
+    def configure_canvas(self, grid_frame: Frame, renderer: str):
         """
-        initializes a canvas of rectangle items
-        corresponding to cells in the game field's grid
+        initializes a canvas on which renderer draws
+        the cells in the game field's grid
         """
         game = self.game
         canvas = Canvas(grid_frame, relief='flat', bd=0)
@@ -377,26 +109,29 @@ class GameFrame(Frame):
             width=(data.canvas_dmn(game.dmn.x) - data.GUI_CELL_PAD),
         )
         # draw cells for each cell in the game
-        for y in range(game.dmn.y):
-            for x in range(game.dmn.x):
-                x0 = data.canvas_dmn(x)
-                y0 = data.canvas_dmn(game.dmn.y - 1 - y)
-                # create a rectangle canvas item
-                # and link it to a Cell object
-                cell = game.grid[y][x]
-                cell.canvas_id = canvas.create_rectangle(
-                    x0, y0, x0 + data.GUI_CELL_WID, y0 + data.GUI_CELL_WID,
-                    fill=self.cs[cell.key], tags='%d' % y, width=0
-                )
+        shown = [[cell.key for cell in game.grid[y]] for y in range(game.dmn.y)]
+        self.renderer = RENDERERS[renderer](canvas, shown, self.cs)
+        # outlines for the ghost piece, drawn above the cells
+        ghost_ids = []
+        for i in range(game.shape_size):
+            ghost_ids.append(canvas.create_rectangle(
+                0, 0, 0, 0, fill='', width=1, state='hidden'
+            ))
         canvas.pack(side='top')
         self.canvas = canvas
+        self.shown = shown
+        self.dirty = set()
+        self.shape_cells = frozenset()
+        self.ghost_ids = tuple(ghost_ids)
+        self.ghost = None
         self.draw_shape()
 
     def __init__(self, master: Tk,
                  num_rows: int, num_cols: int,
-                 bindings: dict):
+                 bindings: dict, renderer: str = 'rectangles'):
         """
-        initializes a GameFrame instance
+        initializes a GameFrame instance.
+        renderer is a key of render.RENDERERS.
         """
         assert isinstance(master, TetrisApp)
         super(GameFrame, self).__init__(master)
@@ -410,6 +145,8 @@ class GameFrame(Frame):
         )
         self.game = game
         self.bindings = bindings
+        self.undo_stack = deque(maxlen=data.UNDO_LIMIT + 1)
+        self.undo_stack.append(game.snapshot())
         self.cs = data.COLOR_SCHEMES[game.shape_size]['default']
         # Associate the parent's speed variable to update
         self.speed_index_int_var = master.speed_index_int_var
@@ -441,7 +178,7 @@ class GameFrame(Frame):
         self.next_shape.redraw_shape(self.game.next_shape.name)
 
         # Configure the canvas
-        self.configure_canvas(grid_frame)
+        self.configure_canvas(grid_frame, renderer)
 
         # Configure the stockpile display
         stockpile_frame = Frame(self)
@@ -460,81 +197,171 @@ class GameFrame(Frame):
 
         self.set_color_scheme()
         self.master.bind('<Button-1>', self.start, '+')
-        self.master.bind('<Key>', self.decode_move, '+')
         # TODO: bind to a custom event that makes ceiling length increase
 
-    def draw_shape(self, erase: bool = False):
+    def request_flush(self):
         """
-        requires that the current Shape is in the grid
-        such that all corresponding Cell objects exist.
+        flushes the dirty cells once the gui is idle, so that
+        all the changes of a frame are drawn together.
         """
-        game = self.game
-        key: str = game.curr_shape.name
-        if erase:
-            key = data.CELL_EMPTY_KEY
-        for t in game.curr_shape.tiles:
-            cell = game.cell_at_tile(t.p[game.rot])
-            cell.key = key
-            if hasattr(cell, 'canvas_id'):
-                self.canvas.itemconfigure(
-                    cell.canvas_id, fill=self.cs[key]
-                )  # else rotated out the top of the grid
-        return
-
-    def spawn_next_shape(self):
-        if self.game.spawn_next_shape():
-            self.draw_shape()
-            self.game_over()
-        else:
-            self.draw_shape()
-            self.next_shape.redraw_shape(self.game.next_shape.name)
+        if self.flush_after_id is None:
+            self.flush_after_id = self.after_idle(self.flush)
 
-    def set_curr_shape(self):
+    def mark_rows(self, rows):
         """
-        actions performed when a shape
-        contacts something underneath itself
+        marks every visible cell in rows as dirty.
+        """
+        width = self.game.dmn.x
+        for y in rows:
+            if y < self.game.dmn.y:
+                self.dirty.update((x, y) for x in range(width))
+        self.request_flush()
 
-        call whenever a call to
-        Game.translate() returns True
+    def flush(self):
         """
-        game = self.game
+        has the renderer draw the dirty cells whose
+        key really changed, and moves the ghost if
+        it changed.
+        """
+        if self.flush_after_id is not None:
+            self.after_cancel(self.flush_after_id)
+            self.flush_after_id = None
+        grid = self.game.grid
+        shown = self.shown
+        changed = []
+        for x, y in self.dirty:
+            if (x, y) in self.shape_cells:
+                key = self.shape_key
+            else:
+                key = grid[y][x].key
+            if shown[y][x] != key:
+                shown[y][x] = key
+                changed.append((x, y))
+        self.dirty.clear()
+        if changed:
+            self.renderer.draw(shown, changed, self.cs)
+        self.draw_ghost()
+
+    def redraw_grid(self):
+        """
+        redraws every visible cell in one flush.
+        """
+        self.mark_rows(range(self.game.dmn.y))
+        self.flush()
 
-        # set the tile data for the shape in self.grid
+    def set_game(self, game: Game):
+        """
+        replaces the displayed game with another of the
+        same dimensions, such as one loaded by session.py.
+        """
+        if self.gravity_after_id is not None:
+            self.after_cancel(self.gravity_after_id)
+            self.gravity_after_id = None
+        self.stop_recording()
+        self.game = game
+        self.undo_stack.clear()
+        self.undo_stack.append(game.snapshot())
+        self.set_period()
         self.draw_shape()
-        key = game.curr_shape.name
-        for t in game.curr_shape.tiles:
-            game.cell_at_tile(t.p[game.rot]).key = key
-
-        # check if lines were cleared, handle if so
-        y = self.game.handle_clears()
-        if y is not None:
-            # Calculate the value to use as a period
-            #  based on the total number of lines cleared
-            self.set_period()
-            # Update the canvas
-            for line in self.game.grid[y:self.game.dmn.y - self.game.ceil_len]:
-                for cell in line:
-                    self.canvas.itemconfigure(
-                        tagOrId=cell.canvas_id,
-                        fill=self.cs[cell.key]
-                    )
-            # Update the score label
-            self.score.set('%d : %d' % (self.game.lines, self.game.score))
+        self.redraw_grid()
+        self.next_shape.redraw_shape(game.next_shape.name)
+        for slot in range(game.shape_size):
+            self.stockpile[slot].redraw_shape(game.stockpile[slot])
 
-        # Check to see if the game is over:
-        self.spawn_next_shape()
+    def draw_shape(self):
+        """
+        draws the current shape over the grid at the next
+        flush, if it moved. the shape is not written into
+        the grid, so the game can be changed while it is
+        drawn, and a move that was not allowed draws nothing.
+        """
+        game = self.game
+        x = game.pos.x
+        y = game.pos.y
+        cells = frozenset(
+            (x + dx, y + dy) for dx, dy in game.curr_shape.offsets[game.rot]
+            if y + dy < game.dmn.y  # else rotated out the top of the grid
+        )
+        key = game.curr_shape.name
+        if cells == self.shape_cells and key == self.shape_key:
+            return
+        self.dirty |= self.shape_cells
+        self.dirty |= cells
+        self.shape_cells = cells
+        self.shape_key = key
+        self.request_flush()
 
-    def translate(self, direction: int = 0):
-        if self.game.translate(direction) and direction is 0:
-            self.set_curr_shape()
+    def draw_ghost(self):
+        """
+        outlines where the current shape would land
+        if it were hard-dropped.
+        """
+        game = self.game
+        y = game.pos.y - game.drop_distance()
+        color = self.cs[game.curr_shape.name]
+        ghost = (game.pos.x, y, game.rot, game.curr_shape.name, color)
+        if ghost == self.ghost:
+            return  # already drawn there
+        self.ghost = ghost
+
+        offsets = game.curr_shape.offsets[game.rot]
+        for i in range(len(self.ghost_ids)):
+            ghost_id = self.ghost_ids[i]
+            if i >= len(offsets) or y + offsets[i][1] >= game.dmn.y:
+                self.canvas.itemconfigure(ghost_id, state='hidden')
+                continue
+            x0 = data.canvas_dmn(game.pos.x + offsets[i][0])
+            y0 = data.canvas_dmn(game.dmn.y - 1 - (y + offsets[i][1]))
+            self.canvas.coords(
+                ghost_id, x0, y0, x0 + data.GUI_CELL_WID, y0 + data.GUI_CELL_WID
+            )
+            self.canvas.itemconfigure(ghost_id, outline=color, state='normal')
 
-    def stockpile_access(self, slot: int):
-        self.draw_shape(erase=True)
-        if self.game.stockpile_access(slot):
-            self.spawn_next_shape()
+    def after_spawn(self):
+        """
+        updates the frame after the game spawned the next
+        shape, or found no room for it.
+        """
+        if self.game.over:
+            self.game_over()
+        else:
+            self.undo_stack.append(self.game.snapshot())
+            self.next_shape.redraw_shape(self.game.next_shape.name)
         self.draw_shape()
 
-        self.stockpile[slot].redraw_shape(self.game.stockpile[slot])
+    def undo(self):
+        """
+        puts the game back to when the shape
+        before the current one spawned.
+        """
+        if len(self.undo_stack) < 2:
+            self.master.bell()
+            return
+        self.undo_stack.pop()
+        self.stop_recording()  # a replay log has no way to go back
+        game = self.game
+        changed = game.restore(self.undo_stack[-1])
+        self.set_period()
+        self.mark_rows(changed)
+        self.score.set('%d : %d' % (game.lines, game.score))
+        self.next_shape.redraw_shape(game.next_shape.name)
+        for slot in range(game.shape_size):
+            self.stockpile[slot].redraw_shape(game.stockpile[slot])
+
+    def after_lock(self):
+        """
+        updates the frame after the game locked the current
+        shape in place and spawned the next one.
+        """
+        game = self.game
+        # Calculate the value to use as a period
+        #  based on the total number of lines cleared
+        self.set_period()
+        # Update the canvas for only the rows that changed
+        self.mark_rows(game.locked_rows)
+        # Update the score label
+        self.score.set('%d : %d' % (game.lines, game.score))
+        self.after_spawn()
 
     def gravity(self):
         """
@@ -545,9 +372,8 @@ class GameFrame(Frame):
         if self.un_paused is None:
             return
 
-        self.draw_shape(erase=True)
-        if self.game.translate():
-            self.set_curr_shape()
+        if self.game.tick():
+            self.after_lock()
         else:
             self.draw_shape()
 
@@ -568,92 +394,92 @@ class GameFrame(Frame):
         if not hasattr(self, 'un_paused'):
             self.un_paused = True
             self.score.set('%d : %d' % (self.game.lines, self.game.score))
+            self.start_recording()
             self.un_pause_gravity()
         else:
             self.master.bell()
 
+    def start_recording(self):
+        """
+        attaches a Recorder to the game, which must be new,
+        with the speed it is played at. the log is written
+        to the recorder's io.BytesIO.
+        """
+        self.stop_recording()
+        self.recorder = replay.Recorder(self.game, speed_index=self.speed_index_int_var.get())
+
+    def stop_recording(self):
+        """
+        ends the log of the game, if it is being recorded.
+        """
+        if self.game.recorder is not None:
+            self.game.recorder.close()
+
     def restart(self):
-        self.after_cancel(self.gravity_after_id)
-        self.game.restart()
-        self.set_period()
+        """
+        starts a new game, with its own seed, so
+        that each replay log holds one game.
+        """
+        game = self.game
+        self.set_game(Game(game.shape_size, game.dmn.y, game.dmn.x, game.shape_set))
         self.score.set('%d : %d' % (self.game.lines, self.game.score))
-        self.set_color_scheme()
+        self.start_recording()
         self.un_paused = True
         self.un_pause_gravity()
 
-    def decode_move(self, event):
-        key = event.keysym
-        b = self.bindings
+    def perform(self, action: str, arg: int = 0):
+        """
+        performs one of the actions in this player's bindings.
+        arg is the slot for data.STOCKPILE.
+        """
         if not hasattr(self, 'un_paused'):
             return  # game hasn't even started yet
-        if key in b[data.RESTART]:
+        if action == data.RESTART:
             self.restart()
             return
         if self.un_paused is None:
             return  # game is paused
-        self.draw_shape(erase=True)
 
         # Game paused
         if not self.un_paused:
-            if key in b[data.PAUSE]:
+            if action == data.PAUSE:
+                self.game.step(action)
                 self.un_paused = True
                 self.un_pause_gravity()
-                self.draw_shape()
-                return
-            else:
-                self.draw_shape()  # Undo the erase first
-                return
-
-        # Rotation
-        if key in b[data.RCC]:
-            self.game.rotate(3)
-        elif key in b[data.RCW]:
-            self.game.rotate(1)
+            return
 
-        # Downward translation
-        elif key in b[data.TSD]:
-            self.after_cancel(self.gravity_after_id)
-            self.translate()
-            self.un_pause_gravity()
-        elif key in b[data.THD]:
+        game = self.game
+        if action == data.PAUSE:
+            game.step(action)
+            self.un_paused = False
             self.after_cancel(self.gravity_after_id)
-            done = self.game.translate()
-            while not done:
-                done = self.game.translate()
-            self.set_curr_shape()
-            self.un_pause_gravity()
+        elif action == data.UNDO:
+            self.undo()
 
-        # Left translation
-        elif key in b[data.TSL]:
-            self.translate(3)
-        elif key in b[data.THL]:
-            done = self.game.translate(3)
-            while not done:
-                done = self.game.translate(3)
-
-        # Right translation
-        elif key in b[data.TSR]:
-            self.translate(1)
-        elif key in b[data.THR]:
-            done = self.game.translate(1)
-            while not done:
-                done = self.game.translate(1)
-
-        # Game un-paused -> Pause game
-        elif key in b[data.PAUSE] and self.un_paused:
-            self.un_paused = False
+        # Downward translation restarts the gravity period
+        elif action in (data.TSD, data.THD):
             self.after_cancel(self.gravity_after_id)
+            if game.step(action):
+                self.after_lock()
+            self.un_pause_gravity()
 
         # Stockpile access
+        elif action == data.STOCKPILE:
+            spawns = game.stockpile[arg] is data.SHAPE_EMPTY_NAME
+            game.step(action, arg)
+            if spawns:
+                self.after_spawn()
+            self.stockpile[arg].redraw_shape(game.stockpile[arg])
+
+        # Rotation and sideways translation
         else:
-            for slot in range(self.game.shape_size):
-                if key in b[data.STOCKPILE][slot]:
-                    self.stockpile_access(slot)
+            game.step(action)
 
         self.draw_shape()
 
     def game_over(self):
         self.un_paused = None
+        self.stop_recording()
 
     def set_period(self, *args):
         """
@@ -666,8 +492,10 @@ class GameFrame(Frame):
         )
 
     def change_shape_set(self, *args):
-        self.draw_shape(erase=True)
+        self.stop_recording()
         self.game.change_shape_set(self.shape_set.get())
+        self.undo_stack.clear()
+        self.undo_stack.append(self.game.snapshot())
 
         self.next_shape.redraw_shape(self.game.next_shape.name)
         for slot in range(self.game.shape_size):
@@ -691,12 +519,8 @@ class GameFrame(Frame):
         # redraw the main canvas
         self.canvas.master.configure(bg=self.cs['bg'])
         self.canvas.configure(bg=self.cs['grid-lines'])
-        for y in range(self.game.dmn.y):
-            for cell in self.game.grid[y]:
-                self.canvas.itemconfigure(
-                    cell.canvas_id, fill=self.cs[cell.key]
-                )
-        self.draw_shape()
+        self.renderer.recolor(self.shown, self.cs)
+        self.draw_ghost()
         self.score_label.configure(bg=self.cs['bg'], fg=self.cs['text'])
 
         # redraw each slot in the stockpile
@@ -715,7 +539,17 @@ class TetrisApp(Tk):
     speed_index_int_var: IntVar
     shapes_string_var: StringVar
     cs_string_var: StringVar
+    sprites: SpriteCache        # preview images shared by every player's ShapeFrames
     players: tuple
+    keymap: {str: tuple, }      # map from a keysym to the (player, action, arg)s it triggers
+    das_ms: int                 # see data.DAS_MS
+    arr_ms: int                 # see data.ARR_MS
+    clock: callable             # returns the time in seconds
+    pressed: [str, ]            # keysyms pressed since the last input tick, in order
+    held: {int: (str, int), }   # map from a held keycode to the keysym it was pressed as and the
+    #                             time in ms of its next repeat, or None if none of its actions repeat
+    releases: {int: int, }      # map from a released keycode to its event time, until the next tick
+    input_after_id = None       # Alarm identifier of the next input tick
 
     def configure_menu(self):
         menu_bar = Menu(self)
@@ -762,7 +596,16 @@ class TetrisApp(Tk):
                  shape_size: int = data.DEFAULT_SHAPE_SIZE,
                  num_rows: int = None,
                  num_cols: int = None,
-                 num_players: int = 1):
+                 num_players: int = 1,
+                 renderer: str = 'rectangles',
+                 das_ms: int = data.DAS_MS,
+                 arr_ms: int = data.ARR_MS):
+        """
+        renderer is a key of render.RENDERERS: 'photo'
+        draws each board as one image rather than one
+        canvas item per cell, for large boards.
+        das_ms and arr_ms set how held keys repeat.
+        """
         super(TetrisApp, self).__init__()
         self.title('Tetris - david fong')
         # self.iconbitmap('error')  # TODO: make a tetromino bitmap
@@ -789,16 +632,136 @@ class TetrisApp(Tk):
         self.configure_menu()
 
         # Create and pack GameFrame objects
+        self.sprites = SpriteCache(self)
         assert num_players > 0
         players = []
         for player_num in range(num_players):
             player = GameFrame(
                 self, num_rows, num_cols,
-                data.get_default_bindings(num_players, player_num)
+                data.get_default_bindings(num_players, player_num),
+                renderer
             )
             player.grid(row=0, column=player_num, sticky='w')
             players.append(player)
         self.players = tuple(players)
+        self.compile_bindings()
+
+        # Configure the input layer
+        assert arr_ms > 0
+        self.das_ms = das_ms
+        self.arr_ms = arr_ms
+        self.clock = time.monotonic
+        self.pressed = []
+        self.held = {}
+        self.releases = {}
+        self.bind('<KeyPress>', self.key_press, '+')
+        self.bind('<KeyRelease>', self.key_release, '+')
+        self.bind('<FocusOut>', self.release_keys, '+')
+
+    def compile_bindings(self):
+        """
+        builds the keymap from every player's bindings.
+        call again after changing a player's bindings.
+        """
+        keymap = {}
+        for player in self.players:
+            for action, keys in player.bindings.items():
+                if action == data.STOCKPILE:
+                    targets = [
+                        (key, slot) for slot in range(len(player.stockpile))
+                        for key in keys[slot]
+                    ]
+                else:
+                    targets = [(key, 0) for key in keys]
+                for key, arg in targets:
+                    keymap.setdefault(key, []).append((player, action, arg))
+        self.keymap = {key: tuple(targets) for key, targets in keymap.items()}
+
+    def dispatch(self, key: str, repeat: bool = False):
+        """
+        performs the actions bound to key, looked up once for
+        all players in the keymap. if repeat, only performs
+        those in data.REPEATED_ACTIONS.
+        """
+        for player, action, arg in self.keymap.get(key, ()):
+            if not repeat or action in data.REPEATED_ACTIONS:
+                player.perform(action, arg)
+
+    def key_press(self, event):
+        """
+        records a key press for the next input tick. a press of
+        a held key is the os repeating it, and is ignored: on x11
+        a repeat also sends a release at the same event time,
+        which is cancelled here before any tick applies it.
+        keys are held by keycode, since a key's keysym changes
+        if a modifier is let go of before it.
+        """
+        key = event.keysym
+        if key not in self.keymap:
+            return
+        code = event.keycode
+        released = self.releases.pop(code, None)
+        if code in self.held:
+            if released is None or released == event.time:
+                return
+            del self.held[code]     # a real release, then a new press
+        self.pressed.append(key)
+        repeats = any(action in data.REPEATED_ACTIONS for _, action, _ in self.keymap[key])
+        self.held[code] = (key, int(self.clock() * 1000) + self.das_ms if repeats else None)
+        self.request_input_tick()
+
+    def key_release(self, event):
+        if event.keycode in self.held:
+            self.releases[event.keycode] = event.time
+            self.request_input_tick()
+
+    def release_keys(self, *args):
+        """
+        lets go of every held key, whose releases
+        are not sent once the window loses focus.
+        """
+        for code in self.held:
+            self.releases.setdefault(code, 0)
+        if self.held:
+            self.request_input_tick()
+
+    def request_input_tick(self):
+        """
+        runs an input tick once the gui is idle, so that the
+        events already queued are coalesced into one tick.
+        """
+        if self.input_after_id is None:
+            self.input_after_id = self.after_idle(self.input_tick)
+
+    def input_tick(self):
+        """
+        performs the actions of the keys pressed since the last
+        tick, repeats those of held keys that are due, then
+        lets go of released keys. ticks every data.INPUT_TICK_MS
+        while a key with a repeated action is held, so that
+        repeats do not depend on the os's key repeat rate.
+        """
+        self.input_after_id = None
+        for key in self.pressed:
+            self.dispatch(key)
+        self.pressed.clear()
+
+        now_ms = int(self.clock() * 1000)
+        for code, (key, due_ms) in self.held.items():
+            if due_ms is None:
+                continue
+            # repeats missed by a stall longer than a tick are dropped, not bunched
+            due_ms = max(due_ms, now_ms - data.INPUT_TICK_MS)
+            while due_ms <= now_ms:
+                self.dispatch(key, True)
+                due_ms += self.arr_ms
+            self.held[code] = (key, due_ms)
+
+        for code in self.releases:
+            del self.held[code]
+        self.releases.clear()
+        if any(due_ms is not None for key, due_ms in self.held.values()):
+            self.input_after_id = self.after(data.INPUT_TICK_MS, self.input_tick)
 
     def popup_controls(self):
         """
@@ -814,10 +777,24 @@ class TetrisApp(Tk):
 
 
 def main():
-    options = str(list(data.DEFAULT_BINDINGS.keys()))
-    num_players = input('input a number of players in %s: ' % options)
-    app = TetrisApp(num_players=int(num_players))
+    """
+    python game.py [SESSION] resumes the session saved
+    in the file SESSION, if it exists, and saves the
+    session there when the window is closed.
+    """
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    if path is not None and os.path.exists(path):
+        import session
+        app = session.load(path)
+    else:
+        options = str(list(data.DEFAULT_BINDINGS.keys()))
+        num_players = input('input a number of players in %s: ' % options)
+        app = TetrisApp(num_players=int(num_players))
+    if path is not None:
+        import session
+        session.save_on_close(app, path)
     app.mainloop()
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,604 @@
+from collections import OrderedDict
+
+import data
+import zobrist
+from bitboard import BitBoard
+from engine import Game
+from shapes import Shape
+from zobrist import TranspositionTable
+
+SEARCH_CACHE_SIZE = 64  # number of searches remembered by reachable()
+
+"""
+Weights for each feature of the board a placement leaves.
+Higher valued placements are better. Any weights may be
+given, with the same keys.
+"""
+WEIGHTS = {
+    'height': -0.510066,
+    'lines': 0.760666,
+    'holes': -0.35663,
+    'bumpiness': -0.184483,
+}
+
+
+def popcount(mask: int):
+    return bin(mask).count('1')
+
+
+def remove_rows(mask: int, rows: [int, ], ceiling: int):
+    """
+    removes the bits at the indices in rows (sorted
+    ascending) from a column's bitmask, making the
+    bits above them fall, up to the ceiling.
+    """
+    high = mask >> ceiling << ceiling
+    mask ^= high
+    for row in reversed(rows):
+        mask = (mask & ((1 << row) - 1)) | (mask >> (row + 1) << row)
+    return mask | high
+
+
+class Board:
+    """
+    A lightweight view of the occupancy of
+    a Game's grid, used to evaluate placements
+    without touching or copying the Game.
+
+    Each column is an integer bitmask where
+    bit y is set if the cell in row y is filled.
+    """
+    num_cols: int
+    num_rows: int       # total rows, including those above the ceiling
+    ceiling: int        # rows at or above this don't fall when lines clear
+    columns: [int, ]    # bitmask of the filled cells of each column
+    fill: [int, ]       # number of filled cells in each row
+    heights: [int, ]    # 1 + the highest filled row of each column, or 0
+    holes: [int, ]      # number of empty cells under the height of each column
+    total_holes: int
+    zobrist: ((int, ), )
+    hash: int           # same as Game.hash for the same occupancy
+
+    def __init__(self, columns: [int, ], fill: [int, ], ceiling: int, hash: int = None):
+        self.num_cols = len(columns)
+        self.num_rows = len(fill)
+        self.ceiling = ceiling
+        self.columns = columns
+        self.fill = fill
+        self.heights = [mask.bit_length() for mask in columns]
+        self.holes = [h - popcount(mask) for h, mask in zip(self.heights, columns)]
+        self.total_holes = sum(self.holes)
+        self.zobrist = zobrist.keys(self.num_rows, self.num_cols)
+        if hash is None:
+            hash = zobrist.hash_columns(self.zobrist, columns)
+        self.hash = hash
+
+    @staticmethod
+    def from_game(game: Game):
+        columns = [0] * game.dmn.x
+        for y, row in enumerate(game.grid):
+            if game.row_fill[y]:
+                bit = 1 << y
+                for x in range(game.dmn.x):
+                    if not row[x].is_empty():
+                        columns[x] |= bit
+        return Board(columns, list(game.row_fill), game.dmn.y - game.ceil_len, game.hash)
+
+    def landing_y(self, shape: Shape, rot: int, x: int):
+        """
+        returns the pivot row where the shape comes to
+        rest when dropped from above the column heights,
+        or None if it would not fit in the grid there.
+        """
+        y = None
+        for dx, dy in shape.bottoms[rot]:
+            if x + dx < 0 or x + dx >= self.num_cols:
+                return None
+            rest = self.heights[x + dx] - dy
+            if y is None or rest > y:
+                y = rest
+        if y + shape.extremes[rot][2] >= self.num_rows:
+            return None
+        return y
+
+    def features(self, shape: Shape, rot: int, x: int, y: int):
+        """
+        returns the aggregate height, number of holes,
+        bumpiness and number of lines cleared of the board
+        that would result from placing the shape.
+        """
+        bits = {}
+        per_row = {}
+        for dx, dy in shape.offsets[rot]:
+            bits[x + dx] = bits.get(x + dx, 0) | (1 << (y + dy))
+            per_row[y + dy] = per_row.get(y + dy, 0) + 1
+        full = sorted(
+            row for row, n in per_row.items()
+            if row < self.ceiling and self.fill[row] + n == self.num_cols
+        )
+
+        if full:
+            heights = []
+            holes = 0
+            for col in range(self.num_cols):
+                mask = remove_rows(self.columns[col] | bits.get(col, 0), full, self.ceiling)
+                h = mask.bit_length()
+                heights.append(h)
+                holes += h - popcount(mask)
+        else:
+            heights = list(self.heights)
+            holes = self.total_holes
+            for col, bit in bits.items():
+                mask = self.columns[col] | bit
+                h = mask.bit_length()
+                heights[col] = h
+                holes += h - popcount(mask) - self.holes[col]
+
+        bumpiness = 0
+        for col in range(self.num_cols - 1):
+            bumpiness += abs(heights[col] - heights[col + 1])
+        return sum(heights), holes, bumpiness, len(full)
+
+    def place(self, shape: Shape, rot: int, x: int, y: int):
+        """
+        returns a new Board with the shape placed and
+        any completed lines cleared, and the number of
+        lines cleared. this Board is left unchanged.
+        """
+        columns = list(self.columns)
+        fill = list(self.fill)
+        h = self.hash
+        for dx, dy in shape.offsets[rot]:
+            columns[x + dx] |= 1 << (y + dy)
+            fill[y + dy] += 1
+            h ^= self.zobrist[y + dy][x + dx]
+        full = [row for row in range(self.ceiling) if fill[row] == self.num_cols]
+        if not full:
+            return Board(columns, fill, self.ceiling, h), 0
+        for col in range(self.num_cols):
+            columns[col] = remove_rows(columns[col], full, self.ceiling)
+        kept = [fill[row] for row in range(self.ceiling) if fill[row] != self.num_cols]
+        fill[:self.ceiling] = kept + [0] * len(full)
+        return Board(columns, fill, self.ceiling), len(full)
+
+
+class Placement:
+    """
+    A final resting position of a shape, and the
+    features of the board that placing it would leave.
+    """
+    shape: Shape
+    slot: int = None    # stockpile slot to access before placing, if any
+    rot: int
+    x: int
+    y: int
+    height: int
+    holes: int
+    bumpiness: int
+    lines: int
+    value: float        # weighted sum of the features
+    path: tuple = None  # the shortest actions that reach here, if searched
+
+    def __init__(self, shape: Shape, slot: int, rot: int, x: int, y: int,
+                 path: tuple = None):
+        self.shape = shape
+        self.slot = slot
+        self.rot = rot
+        self.x = x
+        self.y = y
+        self.path = path
+
+    def evaluate(self, board: Board, weights: dict = WEIGHTS):
+        self.height, self.holes, self.bumpiness, self.lines = board.features(
+            self.shape, self.rot, self.x, self.y
+        )
+        self.value = (
+            weights['height'] * self.height
+            + weights['lines'] * self.lines
+            + weights['holes'] * self.holes
+            + weights['bumpiness'] * self.bumpiness
+        )
+        return self.value
+
+    def actions(self, game: Game):
+        """
+        returns the actions that move the current shape
+        of game (or the shape in the stockpile slot) here.
+        """
+        if self.path is not None:
+            return list(self.path)
+        actions = []
+        if self.slot is None:
+            rot = game.rot
+            x = game.pos.x
+        else:
+            actions.append((data.STOCKPILE, self.slot))
+            rot = 0
+            x = game.pos.x
+            if game.stockpile[self.slot] is data.SHAPE_EMPTY_NAME:
+                x = int(game.dmn.x / 2)  # the next shape spawns
+        turns = (self.rot - rot) % 4
+        if turns == 3:
+            actions.append(data.RCC)
+        else:
+            actions += [data.RCW] * turns
+        if self.x < x:
+            actions += [data.TSL] * (x - self.x)
+        else:
+            actions += [data.TSR] * (self.x - x)
+        actions.append(data.THD)
+        return actions
+
+    def __repr__(self):
+        return 'Placement(%s, slot=%s, rot=%d, x=%d, y=%d)' % (
+            self.shape.name, self.slot, self.rot, self.x, self.y
+        )
+
+
+def candidate_shapes(game: Game, stockpile: bool = False):
+    """
+    returns (slot, shape, rot, x, y) tuples of the shapes
+    that could be placed next and where they would start:
+    the current shape with a slot of None, and if stockpile
+    is True, the shape that accessing each stockpile slot
+    would give, following the rules of Game.stockpile_access.
+    each shape appears once.
+    """
+    candidates = [(None, game.curr_shape, game.rot, game.pos.x, game.pos.y)]
+    if not stockpile:
+        return candidates
+    names = {game.curr_shape.name}
+    shapes = data.SHAPES[game.shape_size][game.shape_set]
+    spawn_x = int(game.dmn.x / 2)
+    for slot in range(len(game.stockpile)):
+        name = game.stockpile[slot]
+        if name is data.SHAPE_EMPTY_NAME:
+            shape = game.next_shape
+            spawn_y = game.dmn.y - (1 + game.ceil_len + shape.extremes[0][2])
+            if not game.shape_fits(shape, 0, spawn_x, spawn_y):
+                continue
+            start = (spawn_x, spawn_y)
+        else:
+            shape = shapes[name]
+            if not game.shape_fits(shape, 0, game.pos.x, game.pos.y):
+                continue
+            start = (game.pos.x, game.pos.y)
+        if shape.name not in names:
+            names.add(shape.name)
+            candidates.append((slot, shape, 0) + start)
+    return candidates
+
+
+def enumerate_placements(game: Game, weights: dict = WEIGHTS,
+                         stockpile: bool = False, board: Board = None):
+    """
+    returns a Placement, evaluated with weights, for every
+    distinct position where a shape dropped straight down
+    from above the stack can come to rest.
+    rotations that are translations of each other are
+    only enumerated once.
+    """
+    if board is None:
+        board = Board.from_game(game)
+    placements = []
+    for slot, shape, _, _, _ in candidate_shapes(game, stockpile):
+        for rot in shape.unique_rots:
+            min_x = -min(dx for dx, dy in shape.offsets[rot])
+            max_x = board.num_cols - 1 - max(dx for dx, dy in shape.offsets[rot])
+            for x in range(min_x, max_x + 1):
+                y = board.landing_y(shape, rot, x)
+                if y is None:
+                    continue
+                placement = Placement(shape, slot, rot, x, y)
+                placement.evaluate(board, weights)
+                placements.append(placement)
+    return placements
+
+
+def bitboard_of(game: Game):
+    """
+    returns the game's BitBoard, or a new
+    one built from its grid if it has none.
+    """
+    if game.bitboard is not None:
+        return game.bitboard
+    board = BitBoard(len(game.grid), game.dmn.x, game.shape_size)
+    for y, row in enumerate(game.grid):
+        if game.row_fill[y]:
+            for x in range(game.dmn.x):
+                if not row[x].is_empty():
+                    board.set_cell(x, y, True)
+    return board
+
+
+def _search(board: BitBoard, shape: Shape, rot: int, x: int, y: int):
+    """
+    a breadth first search over the (rot, x, y) states
+    the shape can reach from the given one by the moves
+    of Game.step. returns (rot, x, y, path) for each
+    distinct set of cells the shape can lock in, where
+    path is the shortest sequence of actions ending in
+    data.THD that locks it there.
+
+    while the shape is above every filled cell, moving
+    sideways or rotating commutes with falling, so the
+    rows above the stack are skipped in one soft-drop edge.
+    this makes the search cost depend on the height of
+    the stack's surface rather than of the board.
+
+    states are keyed by a single int, and since the
+    skip edge costs more than one action, states are
+    settled in order of cost from a list of buckets.
+    """
+    pad = board.pad
+    num_rows = len(board.rows) - pad
+    stride = board.num_cols + 2 * pad
+    extremes = shape.extremes
+
+    def fits(r, tx, ty):
+        return ty + extremes[r][2] < num_rows and board.fits(shape, r, tx, ty)
+
+    def key(r, tx, ty):
+        return ((ty + pad) * 4 + r) * stride + tx + pad
+
+    # the lowest pivot row at which every rotation is clear of the stack
+    stack_top = num_rows
+    while stack_top > 0 and board.rows[stack_top + pad - 1] == board.wall:
+        stack_top -= 1
+    air = max(stack_top - extremes[r][0] for r in range(4))
+    skip = y - air if y > air else 0
+
+    start = key(rot, x, y)
+    parents = {start: None}     # settled key -> (parent key, actions)
+    locks = OrderedDict()       # cells -> (key, lock state)
+    buckets = [[(start, None, None, rot, x, y)]]
+    cost = 0
+    while cost < len(buckets):
+        for k, parent, actions, r, tx, ty in buckets[cost]:
+            if k != start:
+                if k in parents:
+                    continue
+                parents[k] = (parent, actions)
+
+            def push(step, move, nr, nx, ny):
+                nk = key(nr, nx, ny)
+                if nk not in parents:
+                    while len(buckets) <= cost + step:
+                        buckets.append([])
+                    buckets[cost + step].append((nk, k, move, nr, nx, ny))
+
+            for angle, move in ((1, data.RCW), (3, data.RCC)):
+                nr = (r + angle) % 4
+                if fits(nr, tx, ty):
+                    push(1, (move, ), nr, tx, ty)
+            for dx, one, slide in ((-1, data.TSL, data.THL), (1, data.TSR, data.THR)):
+                nx = tx + dx
+                if fits(r, nx, ty):
+                    push(1, (one, ), r, nx, ty)
+                    while fits(r, nx + dx, ty):
+                        nx += dx
+                    if nx != tx + dx:
+                        push(1, (slide, ), r, nx, ty)
+            if skip and ty == y:
+                push(skip, (data.TSD, ) * skip, r, tx, air)
+            elif fits(r, tx, ty - 1):
+                push(1, (data.TSD, ), r, tx, ty - 1)
+
+            # hard drop: the first state to reach a lock is the cheapest
+            ly = min(ty, air)
+            while fits(r, tx, ly - 1):
+                ly -= 1
+            cells = frozenset((tx + dx, ly + dy) for dx, dy in shape.offsets[r])
+            if cells not in locks:
+                locks[cells] = (k, (r, tx, ly))
+        cost += 1
+
+    results = []
+    for k, (r, tx, ly) in locks.values():
+        path = [data.THD]
+        while parents[k] is not None:
+            k, actions = parents[k]
+            path.extend(reversed(actions))
+        path.reverse()
+        results.append((r, tx, ly, tuple(path)))
+    return results
+
+
+_search_cache = OrderedDict()
+
+
+def reachable(game: Game, shape: Shape, rot: int, x: int, y: int):
+    """
+    returns the result of _search for the shape starting
+    at (rot, x, y) on the game's board. the results of the
+    last few searches are kept, keyed by the board's rows.
+    """
+    board = bitboard_of(game)
+    memo = (tuple(board.rows), shape.offsets, rot, x, y)
+    if memo in _search_cache:
+        _search_cache.move_to_end(memo)
+        return _search_cache[memo]
+    results = _search(board, shape, rot, x, y)
+    _search_cache[memo] = results
+    if len(_search_cache) > SEARCH_CACHE_SIZE:
+        _search_cache.popitem(last=False)
+    return results
+
+
+def reachable_placements(game: Game, weights: dict = WEIGHTS,
+                         stockpile: bool = False, board: Board = None):
+    """
+    returns an evaluated Placement for every distinct
+    position the shape can lock in using the real moves,
+    including tucks under overhangs and spins, each with
+    the shortest path of actions that gets there.
+    """
+    if board is None:
+        board = Board.from_game(game)
+    placements = []
+    for slot, shape, rot, x, y in candidate_shapes(game, stockpile):
+        prefix = () if slot is None else ((data.STOCKPILE, slot), )
+        for r, tx, ty, path in reachable(game, shape, rot, x, y):
+            placement = Placement(shape, slot, r, tx, ty, prefix + path)
+            placement.evaluate(board, weights)
+            placements.append(placement)
+    return placements
+
+
+def best_placement(game: Game, weights: dict = WEIGHTS,
+                   stockpile: bool = False, search: bool = False):
+    """
+    returns the highest valued placement, or None if
+    the shape has nowhere to go. if search is True,
+    placements reachable only by tucks and spins count.
+    """
+    if search:
+        placements = reachable_placements(game, weights, stockpile)
+    else:
+        placements = enumerate_placements(game, weights, stockpile)
+    if not placements:
+        return None
+    return max(placements, key=lambda p: p.value)
+
+
+def _choices(queue: (str, ), held: (str, ), stockpile: bool):
+    """
+    returns (shape name, queue, held) for each way to
+    pick the next shape to place from the known queue of
+    shapes, accessing at most one stockpile slot first.
+    beyond the root, a swap is assumed to have room.
+    """
+    choices = [(queue[0], queue[1:], held)]
+    if stockpile:
+        for slot, name in enumerate(held):
+            stored = held[:slot] + (queue[0], ) + held[slot + 1:]
+            if name is data.SHAPE_EMPTY_NAME:
+                if len(queue) > 1:
+                    choices.append((queue[1], queue[2:], stored))
+            else:
+                choices.append((name, queue[1:], stored))
+    return list(OrderedDict.fromkeys(choices))
+
+
+def _lookahead_value(board: Board, queue: (str, ), held: (str, ), shapes: dict,
+                     weights: dict, stockpile: bool, table: TranspositionTable,
+                     search: tuple):
+    """
+    returns the value of the best sequence of placements of
+    the shapes in queue: the features of the final board,
+    plus the lines cleared along the way. positions reached
+    by more than one sequence are looked up in table, keyed
+    with search, the weights and stockpile flag as a tuple.
+    """
+    key = (board.hash, queue, held, search)
+    depth = len(queue)
+    entry = table.lookup(key, depth)
+    if entry is not None:
+        return entry.value
+
+    best = float('-inf')
+    for name, rest, stored in _choices(queue, held, stockpile):
+        shape = shapes[name]
+        for rot in shape.unique_rots:
+            min_x = -min(dx for dx, dy in shape.offsets[rot])
+            max_x = board.num_cols - 1 - max(dx for dx, dy in shape.offsets[rot])
+            for x in range(min_x, max_x + 1):
+                y = board.landing_y(shape, rot, x)
+                if y is None:
+                    continue
+                if rest:
+                    child, lines = board.place(shape, rot, x, y)
+                    value = weights['lines'] * lines + _lookahead_value(
+                        child, rest, stored, shapes, weights, stockpile, table, search
+                    )
+                else:
+                    value = Placement(shape, None, rot, x, y).evaluate(board, weights)
+                best = max(best, value)
+    table.store(key, depth, best)
+    return best
+
+
+def lookahead(game: Game, weights: dict = WEIGHTS, stockpile: bool = False,
+              table: TranspositionTable = None, queue: (str, ) = None):
+    """
+    returns the placement of the current (or a stockpiled)
+    shape that leads to the best placements of the shapes
+    known to come after it, with its value set to that of
+    the whole sequence, or None if the shape has nowhere
+    to go. queue names the known shapes after the current
+    one, and defaults to just the game's next shape.
+
+    the table may be kept between calls, and pays off
+    most for long queues and repeated searches. entries
+    are keyed by the weights and stockpile flag as well
+    as the position, but by shape names, so only share a
+    table between games of the same size and shape set.
+    """
+    if table is None:
+        table = TranspositionTable()
+    search = (stockpile, tuple(sorted(weights.items())))
+    if queue is None:
+        queue = (game.next_shape.name, )
+    board = Board.from_game(game)
+    shapes = data.SHAPES[game.shape_size][game.shape_set]
+    held = tuple(game.stockpile)
+    best = None
+    for placement in enumerate_placements(game, weights, stockpile, board):
+        slot = placement.slot
+        if slot is None:
+            rest = tuple(queue)
+            stored = held
+        elif held[slot] is data.SHAPE_EMPTY_NAME:
+            # the next shape is placed, then the current
+            # one is swapped back out of the stockpile
+            rest = (game.curr_shape.name, ) + tuple(queue[1:])
+            stored = held
+        else:
+            rest = tuple(queue)
+            stored = held[:slot] + (game.curr_shape.name, ) + held[slot + 1:]
+        child, lines = board.place(placement.shape, placement.rot, placement.x, placement.y)
+        placement.value = weights['lines'] * lines + _lookahead_value(
+            child, rest, stored, shapes, weights, stockpile, table, search
+        )
+        if best is None or placement.value > best.value:
+            best = placement
+    return best
+
+
+def greedy_policy(game: Game, rng=None):
+    """
+    a policy for selfplay.py that takes the best
+    drop of the current shape, never stockpiling.
+    """
+    placement = best_placement(game)
+    if placement is None:
+        return [data.THD]
+    return placement.actions(game)
+
+
+def heuristic_policy(game: Game, rng=None):
+    """
+    a policy for selfplay.py that takes the
+    best placement by the default weights.
+    """
+    placement = best_placement(game, stockpile=True)
+    if placement is None:
+        return [data.THD]
+    return placement.actions(game)
+
+
+_policy_tables = {}  # a table for each (shape_size, shape_set)
+
+
+def lookahead_policy(game: Game, rng=None):
+    """
+    a policy for selfplay.py that also looks at how
+    well the next shape can be placed afterwards.
+    """
+    table = _policy_tables.get((game.shape_size, game.shape_set))
+    if table is None:
+        table = _policy_tables[(game.shape_size, game.shape_set)] = TranspositionTable()
+    placement = lookahead(game, stockpile=True, table=table)
+    if placement is None:
+        return [data.THD]
+    return placement.actions(game)
@@ -0,0 +1,252 @@
+import os
+import sys
+from collections import OrderedDict
+from tkinter import Canvas, Misc, PhotoImage
+
+import data
+
+"""
+Renderers draw the cells of a GameFrame's board onto its
+canvas. The GameFrame keeps track of which key each cell
+shows, and calls draw with the cells whose key changed,
+and recolor when the color scheme changes.
+"""
+SPRITE_CACHE_SIZE = 64  # number of preview images kept by a SpriteCache
+
+_hex_colors = {}        # map from a color to its '#rrggbb' form
+
+
+def hex_color(widget: Misc, color: str):
+    """
+    returns a color in the '#rrggbb' form, which
+    can be put into a PhotoImage as a list item.
+    """
+    hex_color = _hex_colors.get(color)
+    if hex_color is None:
+        r, g, b = widget.winfo_rgb(color)
+        hex_color = _hex_colors[color] = '#%02x%02x%02x' % (r >> 8, g >> 8, b >> 8)
+    return hex_color
+
+
+def put_rows(widget: Misc, image: PhotoImage, rows: [[str, ], ], cs: dict, ys=None):
+    """
+    draws the cells of the rows of keys with index in ys
+    (all of them by default) into image, with one put of
+    a strip of pixels per row. rows[0] is drawn at the
+    bottom, and the gaps between cells are left as they are.
+    """
+    width = data.canvas_dmn(len(rows[0])) - data.GUI_CELL_PAD
+    lines = hex_color(widget, cs['grid-lines'])
+    for y in range(len(rows)) if ys is None else ys:
+        pixels = [lines] * width
+        for x, key in enumerate(rows[y]):
+            x0 = data.canvas_dmn(x)
+            pixels[x0:x0 + data.GUI_CELL_WID] = [hex_color(widget, cs[key])] * data.GUI_CELL_WID
+        y0 = data.canvas_dmn(len(rows) - 1 - y)
+        image.put('{%s}' % ' '.join(pixels), to=(0, y0, width, y0 + data.GUI_CELL_WID))
+
+
+class RectRenderer:
+    """
+    Draws each cell as a rectangle canvas item. Items
+    are tagged by the key they draw, so that a color
+    scheme is applied with one call per key.
+    """
+    canvas: Canvas
+    num_rows: int
+    canvas_ids: tuple       # 2D tuple of canvas item ids for each visible Cell
+    key_tags: {str: str, }  # map from a key to the tag of the canvas items drawing it
+
+    def __init__(self, canvas: Canvas, shown: [[str, ], ], cs: dict):
+        self.canvas = canvas
+        self.num_rows = len(shown)
+        self.key_tags = {}
+        canvas_ids = []
+        for y, keys in enumerate(shown):
+            row = []
+            for x, key in enumerate(keys):
+                x0 = data.canvas_dmn(x)
+                y0 = data.canvas_dmn(self.num_rows - 1 - y)
+                row.append(canvas.create_rectangle(
+                    x0, y0, x0 + data.GUI_CELL_WID, y0 + data.GUI_CELL_WID,
+                    fill=cs[key], tags=self.key_tag(key), width=0
+                ))
+            canvas_ids.append(tuple(row))
+        self.canvas_ids = tuple(canvas_ids)
+
+    def key_tag(self, key: str):
+        """
+        returns the tag of the canvas items drawing key.
+        """
+        tag = self.key_tags.get(key)
+        if tag is None:
+            tag = self.key_tags[key] = 'key%d' % len(self.key_tags)
+        return tag
+
+    def draw(self, shown: [[str, ], ], changed: [(int, int), ], cs: dict):
+        """
+        sets the fill and tag of the items of the changed
+        cells (x, y) in one call into tcl.
+        """
+        canvas = str(self.canvas)
+        commands = []
+        for x, y in changed:
+            key = shown[y][x]
+            commands.append('%s itemconfigure %d -fill {%s} -tags %s' % (
+                canvas, self.canvas_ids[y][x], cs[key], self.key_tag(key)
+            ))
+        self.canvas.tk.eval('\n'.join(commands))
+
+    def recolor(self, shown: [[str, ], ], cs: dict):
+        for key, tag in self.key_tags.items():
+            self.canvas.itemconfigure(tag, fill=cs[key])
+
+
+class PhotoRenderer:
+    """
+    Draws the whole board into one PhotoImage, so that the
+    canvas has a single item however large the board is.
+    Each changed row is redrawn with one put of a strip
+    of pixels, which tk repeats down the row's height.
+    """
+    canvas: Canvas
+    image: PhotoImage
+    num_rows: int
+    num_cols: int
+    width: int              # of the image, in pixels
+    height: int
+
+    def __init__(self, canvas: Canvas, shown: [[str, ], ], cs: dict):
+        self.canvas = canvas
+        self.num_rows = len(shown)
+        self.num_cols = len(shown[0])
+        self.width = data.canvas_dmn(self.num_cols) - data.GUI_CELL_PAD
+        self.height = data.canvas_dmn(self.num_rows) - data.GUI_CELL_PAD
+        self.image = PhotoImage(master=canvas, width=self.width, height=self.height)
+        canvas.create_image(0, 0, image=self.image, anchor='nw')
+        self.recolor(shown, cs)
+
+    def draw(self, shown: [[str, ], ], changed: [(int, int), ], cs: dict):
+        put_rows(self.canvas, self.image, shown, cs, set(y for x, y in changed))
+
+    def recolor(self, shown: [[str, ], ], cs: dict):
+        self.image.put(hex_color(self.canvas, cs['grid-lines']), to=(0, 0, self.width, self.height))
+        put_rows(self.canvas, self.image, shown, cs)
+
+
+class SpriteCache:
+    """
+    Preview images of shapes, keyed by shape size, shape
+    set, color scheme and shape name, made when first asked
+    for. The capacity least recently used images are kept:
+    a ShapeFrame keeps a reference to the image it shows,
+    so evicting it does not blank the frame.
+    """
+    master: Misc
+    capacity: int
+    sprites: OrderedDict
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, master: Misc, capacity: int = SPRITE_CACHE_SIZE):
+        assert capacity > 0
+        self.master = master
+        self.capacity = capacity
+        self.sprites = OrderedDict()
+
+    def get(self, shape_size: int, shape_set: str, scheme: str, name: str):
+        """
+        returns the PhotoImage of the shape called name in its
+        first rotation, or of empty cells for data.SHAPE_EMPTY_NAME.
+        """
+        memo = (shape_size, shape_set, scheme, name)
+        sprite = self.sprites.get(memo)
+        if sprite is not None:
+            self.sprites.move_to_end(memo)
+            self.hits += 1
+            return sprite
+        self.misses += 1
+
+        cs = data.COLOR_SCHEMES[shape_size][scheme]
+        rows = [[data.CELL_EMPTY_KEY] * shape_size for _ in range(shape_size)]
+        if name != data.SHAPE_EMPTY_NAME:
+            pivot = int(shape_size / 2)
+            for x, y in data.SHAPES[shape_size][shape_set][name].offsets[0]:
+                rows[pivot + y][pivot + x] = name
+        side = data.canvas_dmn(shape_size) - data.GUI_CELL_PAD
+        sprite = PhotoImage(master=self.master, width=side, height=side)
+        sprite.put(hex_color(self.master, cs['grid-lines']), to=(0, 0, side, side))
+        put_rows(self.master, sprite, rows, cs)
+
+        self.sprites[memo] = sprite
+        if len(self.sprites) > self.capacity:
+            self.sprites.popitem(last=False)
+        return sprite
+
+
+RENDERERS = {
+    'rectangles': RectRenderer,
+    'photo': PhotoRenderer,
+}
+
+
+def benchmark(renderer: str, num_rows: int, num_cols: int, num_players: int,
+              frames: int = 200):
+    """
+    returns the seconds taken by a TetrisApp drawn with
+    renderer to open, to draw frames frames in which every
+    player's shape moves and a row changes (sparse updates),
+    to redraw every cell of every board (full redraws), and
+    to switch color schemes. requires a display.
+    """
+    import random
+    import time
+    from game import TetrisApp
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    app = TetrisApp(num_rows=num_rows, num_cols=num_cols,
+                    num_players=num_players, renderer=renderer)
+    app.update()
+    opened = time.perf_counter()
+    for frame in range(frames):
+        for player in app.players:
+            game = player.game
+            game.translate(rng.choice((1, 3)))
+            player.draw_shape()
+            player.mark_rows((rng.randrange(game.dmn.y), ))
+            player.flush()
+        app.update()
+    drawn = time.perf_counter()
+    for frame in range(frames // 10):
+        for player in app.players:
+            player.redraw_grid()
+        app.update()
+    redrawn = time.perf_counter()
+    schemes = list(data.COLOR_SCHEMES[app.shape_size].keys())
+    for scheme in schemes:
+        app.cs_string_var.set(scheme)
+        app.update()
+    switched = time.perf_counter()
+    app.destroy()
+    return (opened - start, (drawn - opened) / frames,
+            (redrawn - drawn) / (frames // 10), (switched - redrawn) / len(schemes))
+
+
+def main():
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+        print('no display: run this with one, or under xvfb-run python render.py')
+        return 1
+    print('%10s %5s %5s %7s %10s %10s %10s %10s' % (
+        'renderer', 'rows', 'cols', 'players', 'open ms', 'sparse ms', 'full ms', 'colors ms'
+    ))
+    for num_rows, num_cols, num_players in ((20, 10, 1), (20, 10, 2), (80, 40, 2), (200, 100, 1)):
+        for renderer in RENDERERS:
+            times = benchmark(renderer, num_rows, num_cols, num_players)
+            print('%10s %5d %5d %7d %10.1f %10.2f %10.2f %10.1f' % (
+                (renderer, num_rows, num_cols, num_players) + tuple(1000 * t for t in times)
+            ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
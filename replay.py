@@ -0,0 +1,269 @@
+import io
+import sys
+import time
+
+import data
+from engine import Game
+
+"""
+A replay log is a header, then one event per step or tick
+of a Game, then an end marker. Integers are unsigned
+little-endian base-128 varints.
+
+header: MAGIC, VERSION (one byte), then seed, shape_size,
+        num_rows, num_cols, the length and utf-8 bytes of
+        shape_set, and speed_index
+event:  milliseconds since the previous event, then one
+        code byte: the index of the action in data.ACTIONS,
+        plus slot << 4 for data.STOCKPILE, or TICK
+end:    a delay of 0 and the code END, then the lines and
+        score of the game. END is never the code of an
+        event, so it cannot be mistaken for one's delay.
+"""
+MAGIC = b'TRPL'
+VERSION = 2
+TICK = 0x0F     # a tick of gravity, rather than a player action
+END = 0xFF
+
+assert len(data.ACTIONS) < TICK
+
+
+def write_varint(out: bytearray, value: int):
+    assert value >= 0
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(buf, pos: int):
+    """
+    returns the varint starting at buf[pos],
+    and the position of the byte after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode(action: str, slot: int = 0):
+    """
+    returns the code byte of an action. None is a tick.
+    """
+    if action is None:
+        return TICK
+    code = data.ACTIONS.index(action)
+    if action == data.STOCKPILE:
+        assert 0 <= slot < 16
+        code |= slot << 4
+    return code
+
+
+def decode(code: int):
+    """
+    returns (action, slot) for a code byte. a tick is (None, 0).
+    """
+    if code == TICK:
+        return None, 0
+    return data.ACTIONS[code & 0xF], code >> 4
+
+
+class Header:
+    """
+    Everything needed to recreate the game of a log.
+    """
+    seed: int
+    settings: tuple     # (shape_size, num_rows, num_cols, shape_set) as for Game
+    speed_index: int
+
+    def __init__(self, seed: int, settings: tuple, speed_index: int = 0):
+        self.seed = seed
+        self.settings = tuple(settings)
+        self.speed_index = speed_index
+
+    def to_bytes(self):
+        shape_size, num_rows, num_cols, shape_set = self.settings
+        name = shape_set.encode('utf-8')
+        out = bytearray(MAGIC)
+        out.append(VERSION)
+        for value in (self.seed, shape_size, num_rows, num_cols, len(name)):
+            write_varint(out, value)
+        out += name
+        write_varint(out, self.speed_index)
+        return bytes(out)
+
+    @staticmethod
+    def from_bytes(buf, pos: int = 0):
+        """
+        returns the Header at buf[pos], and
+        the position of the byte after it.
+        """
+        assert bytes(buf[pos:pos + len(MAGIC)]) == MAGIC, 'not a replay log'
+        pos += len(MAGIC)
+        assert buf[pos] == VERSION, 'unknown replay log version %d' % buf[pos]
+        pos += 1
+        values = []
+        for _ in range(5):
+            value, pos = read_varint(buf, pos)
+            values.append(value)
+        seed, shape_size, num_rows, num_cols, name_len = values
+        shape_set = bytes(buf[pos:pos + name_len]).decode('utf-8')
+        pos += name_len
+        speed_index, pos = read_varint(buf, pos)
+        return Header(seed, (shape_size, num_rows, num_cols, shape_set), speed_index), pos
+
+    def new_game(self, **kwargs):
+        return Game(*self.settings, seed=self.seed, **kwargs)
+
+
+class Recorder:
+    """
+    Records every step and tick of a new Game into a
+    replay log written to out, a binary file object
+    (an io.BytesIO by default). Events are buffered,
+    and written by flush() or close().
+    """
+    game: Game
+    out: io.RawIOBase
+    clock: callable         # returns the time in seconds
+    last_ms: int            # time of the previous event
+    buffer: bytearray
+    closed: bool = False
+
+    def __init__(self, game: Game, out=None, speed_index: int = 0, clock=time.monotonic):
+        assert game.lines == 0 and not game.prev_shapes, 'attach a Recorder to a new game'
+        self.game = game
+        self.out = io.BytesIO() if out is None else out
+        self.clock = clock
+        self.last_ms = int(clock() * 1000)
+        settings = (game.shape_size, game.dmn.y, game.dmn.x, game.shape_set)
+        self.buffer = bytearray(Header(game.seed, settings, speed_index).to_bytes())
+        self.closed = False
+        game.recorder = self
+
+    def record(self, action: str, slot: int = 0):
+        now_ms = int(self.clock() * 1000)
+        write_varint(self.buffer, max(now_ms - self.last_ms, 0))
+        self.buffer.append(encode(action, slot))
+        self.last_ms = now_ms
+
+    def flush(self):
+        self.out.write(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        """
+        writes the end marker and detaches from the game.
+        """
+        if self.closed:
+            return
+        write_varint(self.buffer, 0)
+        self.buffer.append(END)
+        write_varint(self.buffer, self.game.lines)
+        write_varint(self.buffer, self.game.score)
+        self.flush()
+        self.game.recorder = None
+        self.closed = True
+
+    def getvalue(self):
+        """
+        returns the whole log, if out is an io.BytesIO.
+        """
+        return self.out.getvalue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read(buf):
+    """
+    returns the Header of a log, a list of its events as
+    (ms since the previous event, action, slot), and the
+    (lines, score) of its end marker, or None if the log
+    was not closed.
+    """
+    header, pos = Header.from_bytes(buf)
+    events = []
+    while pos < len(buf):
+        delay, pos = read_varint(buf, pos)
+        if pos >= len(buf):
+            break   # cut off mid-event
+        if buf[pos] == END:
+            lines, pos = read_varint(buf, pos + 1)
+            score, pos = read_varint(buf, pos)
+            return header, events, (lines, score)
+        action, slot = decode(buf[pos])
+        events.append((delay, action, slot))
+        pos += 1
+    return header, events, None
+
+
+def replay(buf, **kwargs):
+    """
+    returns a new headless Game with every event of a log
+    applied. kwargs are passed to Game, such as bitboard.
+    if the log was closed, checks the game ends with the
+    same lines and score.
+    """
+    header, events, end = read(buf)
+    game = header.new_game(**kwargs)
+    for delay, action, slot in events:
+        if action is None:
+            game.tick()
+        else:
+            game.step(action, slot)
+    if end is not None:
+        assert (game.lines, game.score) == end, 'replay diverged from the log: %s != %s' % (
+            (game.lines, game.score), end
+        )
+    return game
+
+
+def check(delays=(0, 1, 127, 128, 255, 383, 16383, 16384)):
+    """
+    records a game with events delays ms apart,
+    and checks a log of it reads back the same.
+    """
+    now_ms = [0]
+    game = Game(data.DEFAULT_SHAPE_SIZE, 20, 10, 'default', seed=1)
+    actions = []
+    with Recorder(game, clock=lambda: (now_ms[0] + 0.5) / 1000) as recorder:
+        for i, delay in enumerate(delays):
+            now_ms[0] += delay
+            action = data.ACTIONS[i % 8]   # the moves, rotations and drops
+            game.step(action)
+            actions.append((delay, action, 0))
+    header, events, end = read(recorder.getvalue())
+    assert events == actions, 'events read back differently: %s' % events
+    assert end == (game.lines, game.score)
+    replay(recorder.getvalue())
+
+
+def main():
+    if sys.argv[1:] == ['--check']:
+        check()
+        print('ok')
+        return
+    for path in sys.argv[1:]:
+        with open(path, 'rb') as f:
+            buf = f.read()
+        header, events, end = read(buf)
+        game = replay(buf)
+        seconds = sum(delay for delay, _, _ in events) / 1000
+        print('%s: %s seed %d, %d events over %.1f seconds, %d bytes. lines %d score %d%s' % (
+            path, header.settings, header.seed, len(events), seconds, len(buf),
+            game.lines, game.score, '' if end is not None else ' (not closed)'
+        ))
+
+
+if __name__ == '__main__':
+    main()
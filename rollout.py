@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import queue
+import random
+import time
+
+import data
+from engine import Game
+from selfplay import RunningStats, get_policy, play
+from shapes import Pair
+
+ROLLOUT_FIELDS = ('lines', 'score', 'pieces', 'over')
+
+
+def capture(game: Game):
+    """
+    returns the state of a game as plain data that
+    can be sent to other processes. see rebuild.
+    """
+    return {
+        'settings': (game.shape_size, game.dmn.y, game.dmn.x, game.shape_set),
+        'cells': tuple(tuple(cell.key for cell in row) for row in game.grid),
+        'curr_shape': game.curr_shape.name,
+        'next_shape': game.next_shape.name,
+        'stockpile': tuple(game.stockpile),
+        'prev_shapes': tuple(game.prev_shapes),
+        'pos': (game.pos.x, game.pos.y),
+        'rot': game.rot,
+        'lines': game.lines,
+        'score': game.score,
+        'combo': game.combo,
+        'over': game.over,
+    }
+
+
+def _name(name: str):
+    # names compared with 'is' must be the same objects as in data
+    return data.SHAPE_EMPTY_NAME if name == data.SHAPE_EMPTY_NAME else name
+
+
+def rebuild(state: dict, seed: int = None):
+    """
+    returns a new Game in the captured state,
+    which draws its next shapes seeded by seed.
+    """
+    game = Game(*state['settings'], bitboard=True, seed=seed)
+    shapes = data.SHAPES[game.shape_size][game.shape_set]
+    game.load_cells(state['cells'])
+    game.curr_shape = shapes[state['curr_shape']]
+    game.next_shape = shapes[state['next_shape']]
+    game.stockpile = [_name(name) for name in state['stockpile']]
+    game.prev_shapes.clear()
+    game.prev_shapes.extend(state['prev_shapes'])
+    game.pos = Pair(*state['pos'])
+    game.rot = state['rot']
+    game.lines = state['lines']
+    game.score = state['score']
+    game.combo = state['combo']
+    game.over = state['over']
+    return game
+
+
+_worker_state = None
+
+
+def _init_worker(state: dict):
+    global _worker_state
+    _worker_state = state
+
+
+def _rollouts(task: tuple):
+    """
+    plays count rollouts from the worker's state.
+    rollout i is seeded with seed + i, so results do
+    not depend on how rollouts are split between workers.
+    """
+    first, count, seed, policy_name, horizon = task
+    policy = get_policy(policy_name)
+    results = []
+    for i in range(first, first + count):
+        rng = random.Random('policy %d' % (seed + i))
+        game = rebuild(_worker_state, seed + i)
+        pieces, _ = play(game, policy, rng, horizon)
+        results.append({
+            'lines': game.lines - _worker_state['lines'],
+            'score': game.score - _worker_state['score'],
+            'pieces': pieces,
+            'over': int(game.over),
+        })
+    return results
+
+
+def evaluate(game: Game, rollouts: int = 1000, seconds: float = None,
+             tolerance: float = None, field: str = 'lines',
+             horizon: int = 50, policy: str = 'greedy', workers: int = None,
+             seed: int = 0, chunksize: int = 8):
+    """
+    estimates the lines and score to be gained from the
+    game's position within the next horizon shapes, by
+    letting policy play many rollouts with random shapes,
+    drawn as by the game with its history of shapes.
+
+    yields a RunningStats of ROLLOUT_FIELDS each time a
+    chunk of rollouts finishes, so that callers can watch
+    the means and stats.interval(field) narrow, and stop
+    early by breaking out of the loop. it stops by itself
+    after rollouts rollouts, after seconds have passed,
+    or once the 95% confidence interval of the mean of
+    field is no wider than +/- tolerance.
+    if workers is 0, rollouts are played in this process.
+    """
+    state = capture(game)
+    stats = RunningStats(ROLLOUT_FIELDS)
+    start = time.perf_counter()
+    chunks = (
+        (first, min(chunksize, rollouts - first), seed, policy, horizon)
+        for first in range(0, rollouts, chunksize)
+    )
+
+    def done():
+        if seconds is not None and time.perf_counter() - start >= seconds:
+            return True
+        return tolerance is not None and stats.interval(field) <= tolerance
+
+    if workers == 0:
+        _init_worker(state)
+        for task in chunks:
+            for result in _rollouts(task):
+                stats.add(result)
+            yield stats
+            if done():
+                return
+        return
+
+    # keep a bounded number of chunks in flight, so
+    # that stopping early wastes little work
+    max_in_flight = 2 * (workers or os.cpu_count())
+    finished = queue.Queue()
+    with multiprocessing.Pool(workers, _init_worker, (state, )) as pool:
+        in_flight = 0
+        for task in chunks:
+            pool.apply_async(_rollouts, (task, ), callback=finished.put,
+                             error_callback=finished.put)
+            in_flight += 1
+            while in_flight >= max_in_flight or (in_flight and task[0] + task[1] >= rollouts):
+                results = finished.get()
+                in_flight -= 1
+                if isinstance(results, BaseException):
+                    raise results
+                for result in results:
+                    stats.add(result)
+                yield stats
+                if done():
+                    return
+
+
+def compare(game: Game, placements: list, **budget):
+    """
+    returns the final RunningStats of evaluate for the
+    position after each placement, in the same order.
+    placements are from placement.py, and budget takes
+    the keyword arguments of evaluate.
+    """
+    results = []
+    for placement in placements:
+        after = rebuild(capture(game))
+        for action in placement.actions(game):
+            if isinstance(action, tuple):
+                locked = after.step(*action)
+            else:
+                locked = after.step(action)
+            if locked:
+                break
+        stats = None
+        for stats in evaluate(after, **budget):
+            pass
+        results.append(stats)
+    return results
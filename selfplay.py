@@ -0,0 +1,250 @@
+import argparse
+import csv
+import importlib
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import data
+from engine import Game
+from placement import greedy_policy, heuristic_policy, lookahead_policy
+
+RESULT_FIELDS = ('game', 'seed', 'lines', 'score', 'combo', 'pieces', 'duration')
+STAT_FIELDS = ('lines', 'score', 'combo', 'pieces', 'duration')
+
+
+def random_policy(game: Game, rng: random.Random):
+    """
+    rotates the current shape a random number of
+    times, moves it a random distance sideways
+    and hard-drops it.
+    """
+    actions = [data.RCW] * rng.randrange(4)
+    direction = rng.choice((data.TSL, data.TSR))
+    actions += [direction] * rng.randrange(int(game.dmn.x / 2) + 1)
+    actions.append(data.THD)
+    return actions
+
+
+"""
+A policy is called with a Game and a random.Random
+each time a new shape is to be placed, and returns
+a sequence of actions to perform. Each action is a
+constant from data.ACTIONS, or a pair of data.STOCKPILE
+and a slot. Policies not in this dict may be named as
+'module:function'.
+"""
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+    'heuristic': heuristic_policy,
+    'lookahead': lookahead_policy,
+}
+
+
+def get_policy(name: str):
+    if name in POLICIES:
+        return POLICIES[name]
+    module, _, attr = name.partition(':')
+    return getattr(importlib.import_module(module), attr)
+
+
+def play(game: Game, policy, rng: random.Random, max_pieces: int, recorder=None):
+    """
+    lets the policy place shapes until the game
+    is over or max_pieces shapes have been placed.
+    returns the number of shapes placed and the
+    highest combo reached.
+
+    if recorder is given (see dataset.Buffer),
+    each action is recorded with its reward.
+    """
+    pieces = 0
+    max_combo = 0
+    while not game.over and pieces < max_pieces:
+        locked = False
+        for action in policy(game, rng):
+            if not isinstance(action, tuple):
+                action = (action, )
+            if recorder is not None:
+                score = game.score
+                recorder.record(game, *action)
+            locked = game.step(*action)
+            if recorder is not None:
+                recorder.reward(game.score - score)
+            if locked:
+                break
+        if not locked:
+            # gravity makes sure that every turn makes progress
+            while not game.over and not game.tick():
+                pass
+        pieces += 1
+        max_combo = max(max_combo, game.combo)
+    return pieces, max_combo
+
+
+def play_game(task: tuple):
+    """
+    plays one game to the end (or to max_pieces)
+    and returns a dict of its results.
+
+    the game is seeded by its task alone, so
+    results are reproducible no matter which
+    worker process runs it.
+    """
+    index, seed, settings, policy_name, max_pieces, record = task
+    rng = random.Random('policy %d' % seed)
+    policy = get_policy(policy_name)
+    recorder = None
+    if record:
+        import dataset  # needs numpy
+        recorder = dataset.Buffer(dataset.Encoder(settings))
+
+    start = time.perf_counter()
+    game = Game(*settings, bitboard=True, seed=seed)
+    pieces, max_combo = play(game, policy, rng, max_pieces, recorder)
+
+    result = {
+        'game': index,
+        'seed': seed,
+        'lines': game.lines,
+        'score': game.score,
+        'combo': max_combo,
+        'pieces': pieces,
+        'duration': time.perf_counter() - start,
+    }
+    if recorder is not None:
+        result['records'] = recorder.take()
+    return result
+
+
+class RunningStats:
+    """
+    Aggregates results one at a time, keeping
+    only the count, mean, variance and range
+    of each field (Welford's algorithm).
+    """
+    count: int
+    mean: {str: float, }
+    m2: {str: float, }
+    low: {str: float, }
+    high: {str: float, }
+
+    def __init__(self, fields: (str, ) = STAT_FIELDS):
+        self.count = 0
+        self.mean = dict.fromkeys(fields, 0.0)
+        self.m2 = dict.fromkeys(fields, 0.0)
+        self.low = dict.fromkeys(fields, float('inf'))
+        self.high = dict.fromkeys(fields, float('-inf'))
+
+    def add(self, result: dict):
+        self.count += 1
+        for field in self.mean:
+            value = result[field]
+            delta = value - self.mean[field]
+            self.mean[field] += delta / self.count
+            self.m2[field] += delta * (value - self.mean[field])
+            self.low[field] = min(self.low[field], value)
+            self.high[field] = max(self.high[field], value)
+
+    def std(self, field: str):
+        if self.count < 2:
+            return 0.0
+        return (self.m2[field] / (self.count - 1)) ** 0.5
+
+    def interval(self, field: str, z: float = 1.96):
+        """
+        returns the half-width of the confidence interval
+        of the mean of field. z = 1.96 gives 95%.
+        """
+        if self.count < 2:
+            return float('inf')
+        return z * self.std(field) / self.count ** 0.5
+
+    def __str__(self):
+        lines = ['%d games' % self.count]
+        for field in self.mean:
+            lines.append('%10s: mean %12.3f  std %12.3f  min %12.3f  max %12.3f' % (
+                field, self.mean[field], self.std(field), self.low[field], self.high[field]
+            ))
+        return '\n'.join(lines)
+
+
+def run(num_games: int, settings: tuple, policy: str = 'random',
+        workers: int = None, seed: int = 0, max_pieces: int = 10000,
+        chunksize: int = 4, record: bool = False):
+    """
+    yields the results of num_games games as they
+    finish, played across a pool of worker processes.
+    if workers is 0, the games are played in this process.
+    game i is seeded with seed + i. if record is True,
+    each result also has the game's 'records' (see dataset).
+    """
+    tasks = (
+        (i, seed + i, settings, policy, max_pieces, record) for i in range(num_games)
+    )
+    if workers == 0:
+        for task in tasks:
+            yield play_game(task)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(play_game, tasks, chunksize):
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='plays many headless games and reports their results'
+    )
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes. 0 plays in this process')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--policy', default='random',
+                        help='one of %s, or module:function' % list(POLICIES.keys()))
+    parser.add_argument('--max-pieces', type=int, default=10000)
+    parser.add_argument('--shape-size', type=int, default=data.DEFAULT_SHAPE_SIZE)
+    parser.add_argument('--shape-set', default='default')
+    parser.add_argument('--rows', type=int, default=None)
+    parser.add_argument('--cols', type=int, default=None)
+    parser.add_argument('--out', default='-', help='csv file of per-game results')
+    parser.add_argument('--record', metavar='PREFIX', default=None,
+                        help='record every action to .npy shards. requires numpy')
+    parser.add_argument('--shard-mb', type=int, default=256)
+    args = parser.parse_args()
+
+    rows = args.rows or data.DEFAULT_NUM_ROWS[args.shape_size]
+    cols = args.cols or data.DEFAULT_NUM_COLS[args.shape_size]
+    settings = (args.shape_size, rows, cols, args.shape_set)
+
+    out = sys.stdout if args.out == '-' else open(args.out, 'w', newline='')
+    writer = csv.DictWriter(out, RESULT_FIELDS)
+    writer.writeheader()
+    stats = RunningStats()
+    recorder = None
+    if args.record:
+        import dataset
+        recorder = dataset.Recorder(args.record, settings, args.shard_mb << 20)
+    start = time.perf_counter()
+    try:
+        for result in run(args.games, settings, args.policy, args.workers,
+                          args.seed, args.max_pieces, record=recorder is not None):
+            if recorder is not None:
+                recorder.extend(result.pop('records'))
+            writer.writerow(result)
+            stats.add(result)
+            if stats.count % 100 == 0:
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if recorder is not None:
+            recorder.close()
+    print(stats, file=sys.stderr)
+    print('%.2f seconds' % (time.perf_counter() - start), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import argparse
+import random
+import sys
+import time
+import numpy as np
+
+import data
+from engine import Game
+
+GAP_CAP = 2 * data.SHAPE_QUEUE_SIZE  # gaps and runs this long or longer share a category
+RUN_CAP = 8
+
+
+def names(shape_size: int, shape_set: str):
+    """
+    returns the shape names of a set. a shape's code in
+    a sequence is its index here, as in BatchGame.names.
+    """
+    return tuple(data.SHAPES[shape_size][shape_set].keys())
+
+
+def generate(num_games: int, length: int, shape_size: int = data.DEFAULT_SHAPE_SIZE,
+             shape_set: str = 'default', seed: int = None):
+    """
+    returns a (num_games, length) array of shape codes: the
+    shapes each of num_games new games would draw, in order.
+
+    every game is drawn at once, one column at a time. like
+    Game, the first two shapes are drawn with no history,
+    and shape i is drawn with a history of the last
+    data.SHAPE_QUEUE_SIZE shapes before shape i - 1 (which
+    is still falling while shape i is drawn).
+    """
+    rng = np.random.default_rng(seed)
+    num_shapes = len(names(shape_size, shape_set))
+    queue_size = data.SHAPE_QUEUE_SIZE
+    # weights by count, so that drawing needs no powers
+    weight_of = 0.5 ** np.arange(queue_size + 1)
+
+    out = np.empty((num_games, length), np.uint8)
+    counts = np.zeros((num_games, num_shapes), np.int64)
+    rows = np.arange(num_games)
+    for i in range(length):
+        if i >= 2:
+            counts[rows, out[:, i - 2]] += 1
+        if i >= 2 + queue_size:
+            counts[rows, out[:, i - 2 - queue_size]] -= 1
+        total = np.cumsum(weight_of[counts], axis=1)
+        choice = rng.random(num_games) * total[:, -1]
+        picked = (total <= choice[:, None]).sum(axis=1)
+        out[:, i] = np.minimum(picked, num_shapes - 1)
+    return out
+
+
+def reference(num_games: int, length: int, shape_size: int = data.DEFAULT_SHAPE_SIZE,
+              shape_set: str = 'default', seed: int = None):
+    """
+    returns the same kind of array as generate, drawn
+    one shape at a time the way Game.spawn_next_shape
+    draws them, with a data.ShapeHistory. slow.
+    """
+    codes = {name: code for code, name in enumerate(names(shape_size, shape_set))}
+    rng = random.Random(seed)
+    out = np.empty((num_games, length), np.uint8)
+    for g in range(num_games):
+        history = data.ShapeHistory(shape_size, shape_set)
+        next_shape = history.draw(rng)
+        curr_shape = None
+        for i in range(length):
+            if curr_shape is not None:
+                history.append(curr_shape.name)
+            curr_shape = next_shape
+            next_shape = history.draw(rng)
+            out[g, i] = codes[curr_shape.name]
+    return out
+
+
+def legacy_reference(num_games: int, length: int, shape_size: int = data.DEFAULT_SHAPE_SIZE,
+                     shape_set: str = 'default', seed: int = None):
+    """
+    returns the same kind of array as reference, drawn with
+    data.get_random_shape and a list of the last shapes, as
+    Game drew them before data.ShapeHistory. uses the random
+    module's generator, seeded with seed, and puts back its
+    state after. slower still.
+    """
+    codes = {name: code for code, name in enumerate(names(shape_size, shape_set))}
+    state = random.getstate()
+    random.seed(seed)
+    out = np.empty((num_games, length), np.uint8)
+    try:
+        for g in range(num_games):
+            queue = []
+            next_shape = data.get_random_shape(shape_size, shape_set, queue)
+            curr_shape = None
+            for i in range(length):
+                if curr_shape is not None:
+                    queue.append(curr_shape.name)
+                    if len(queue) > data.SHAPE_QUEUE_SIZE:
+                        queue.pop(0)
+                curr_shape = next_shape
+                next_shape = data.get_random_shape(shape_size, shape_set, queue)
+                out[g, i] = codes[curr_shape.name]
+    finally:
+        random.setstate(state)
+    return out
+
+
+def _pooled_chi2(a: np.ndarray, b: np.ndarray):
+    """
+    returns the chi-squared statistic of the homogeneity of
+    two arrays of counts, over their last axis.
+    """
+    scale = np.sqrt(b.sum(axis=-1, keepdims=True) / a.sum(axis=-1, keepdims=True))
+    return (((a * scale - b / scale) ** 2) / (a + b)).sum(axis=-1)
+
+
+def homogeneity(a: np.ndarray, b: np.ndarray, permutations: int = 9999, seed: int = None):
+    """
+    returns (chi2, df, p) of a test that two (games, categories)
+    arrays of counts per game come from the same distribution.
+    chi2 is that of the counts summed over games. counts within
+    a game depend on each other, so p is not read off the
+    chi-squared distribution: it is the share of random
+    reassignments of whole games between a and b whose chi2
+    is at least as large.
+    """
+    a = np.asarray(a, np.float64)
+    b = np.asarray(b, np.float64)
+    games = np.concatenate([a, b])
+    used = games.sum(axis=0) > 0
+    games = games[:, used]
+    chi2 = float(_pooled_chi2(games[:len(a)].sum(axis=0), games[len(a):].sum(axis=0)))
+
+    rng = np.random.default_rng(seed)
+    in_a = np.zeros((permutations, len(games)), bool)
+    in_a[:, :len(a)] = True
+    in_a = rng.permuted(in_a, axis=1)
+    sums = in_a @ games
+    null = _pooled_chi2(sums, games.sum(axis=0) - sums)
+    p = (1 + int((null >= chi2).sum())) / (1 + permutations)
+    return chi2, int(used.sum()) - 1, p
+
+
+def statistics(codes: np.ndarray, num_shapes: int):
+    """
+    returns a dict of (games, categories) count arrays for a
+    (games, length) array of codes: in each game, the frequency
+    of each shape, of each pair of consecutive shapes, of the
+    gaps between a shape and its previous appearance, and of
+    the lengths of runs of the same shape. gaps and runs are
+    capped at GAP_CAP and RUN_CAP.
+    """
+    codes = np.asarray(codes, np.int64)
+    num_games, length = codes.shape
+
+    def per_game(game_of, values, num_values):
+        counts = np.bincount(game_of * num_values + values, minlength=num_games * num_values)
+        return counts.reshape(num_games, num_values)
+
+    game_of = np.repeat(np.arange(num_games), length)
+    flat = codes.ravel()
+    shapes = per_game(game_of, flat, num_shapes)
+    pairs = per_game(game_of[:num_games * (length - 1)],
+                     (codes[:, :-1] * num_shapes + codes[:, 1:]).ravel(), num_shapes ** 2)
+
+    # gaps: for each shape, the distance between its appearances in the same game
+    gaps = np.zeros((num_games, GAP_CAP + 1), np.int64)
+    for code in range(num_shapes):
+        where = np.flatnonzero(flat == code)
+        same_game = game_of[where[1:]] == game_of[where[:-1]]
+        gap = np.minimum(np.diff(where)[same_game], GAP_CAP)
+        gaps += per_game(game_of[where[1:]][same_game], gap, GAP_CAP + 1)
+
+    # runs: where a new run starts, and how long each one is
+    starts = np.ones((num_games, length), bool)
+    starts[:, 1:] = codes[:, 1:] != codes[:, :-1]
+    begin = np.flatnonzero(starts.ravel())
+    end = np.append(begin[1:], flat.size)
+    run = np.minimum(end - begin, RUN_CAP)
+    runs = per_game(game_of[begin], run, RUN_CAP + 1)
+
+    return {'shapes': shapes, 'pairs': pairs, 'gaps': gaps, 'runs': runs}
+
+
+def compare(a: np.ndarray, b: np.ndarray, num_shapes: int, seed: int = None,
+            alpha: float = 1e-3):
+    """
+    returns a dict of homogeneity (chi2, df, p) for each
+    statistic of two arrays of codes, and whether every
+    p is at least alpha.
+    """
+    got = statistics(a, num_shapes)
+    want = statistics(b, num_shapes)
+    report = {key: homogeneity(got[key], want[key], seed=seed) for key in got}
+    return report, all(p >= alpha for chi2, df, p in report.values())
+
+
+def check(codes: np.ndarray, shape_size: int = data.DEFAULT_SHAPE_SIZE,
+          shape_set: str = 'default', reference_games: int = 200,
+          seed: int = None, alpha: float = 1e-3):
+    """
+    compares the statistics of an array of codes with those
+    of sequences of the same length from reference().
+    returns a dict of (chi2, df, p) for each statistic,
+    and whether every p is at least alpha.
+    """
+    num_shapes = len(names(shape_size, shape_set))
+    ref = reference(reference_games, codes.shape[1], shape_size, shape_set, seed)
+    return compare(codes, ref, num_shapes, seed, alpha)
+
+
+def check_history(num_games: int, length: int, shape_size: int = data.DEFAULT_SHAPE_SIZE,
+                  shape_set: str = 'default', seed: int = 0, alpha: float = 1e-3):
+    """
+    compares data.ShapeHistory with data.get_random_shape:
+    draw for draw, given the same history and random stream,
+    and by the statistics of sequences drawn from different
+    streams. returns whether every draw matched, a dict of
+    (chi2, df, p) for each statistic, and whether every
+    draw matched and every p is at least alpha.
+    """
+    num_shapes = len(names(shape_size, shape_set))
+    history = reference(num_games, length, shape_size, shape_set, seed)
+    legacy = legacy_reference(num_games, length, shape_size, shape_set, seed)
+    same = bool(np.array_equal(history, legacy))
+    legacy = legacy_reference(num_games, length, shape_size, shape_set, seed + 1)
+    report, ok = compare(history, legacy, num_shapes, seed, alpha)
+    return same, report, same and ok
+
+
+def decode(sequence: np.ndarray, shape_size: int = data.DEFAULT_SHAPE_SIZE,
+           shape_set: str = 'default'):
+    """
+    returns a tuple of the names of the shapes
+    in a row of codes, for Game.sequence.
+    """
+    shape_names = names(shape_size, shape_set)
+    return tuple(shape_names[code] for code in sequence.tolist())
+
+
+def new_game(sequence: np.ndarray, shape_size: int = data.DEFAULT_SHAPE_SIZE,
+             num_rows: int = None, num_cols: int = None,
+             shape_set: str = 'default', **kwargs):
+    """
+    returns a Game whose shapes are taken from a row of
+    codes, then drawn as usual once the row is used up.
+    """
+    if num_rows is None:
+        num_rows = data.DEFAULT_NUM_ROWS[shape_size]
+    if num_cols is None:
+        num_cols = data.DEFAULT_NUM_COLS[shape_size]
+    game = Game(shape_size, num_rows, num_cols, shape_set, **kwargs)
+    game.sequence = decode(sequence, shape_size, shape_set)
+    game.restart()
+    return game
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='pregenerates shape sequences and checks them against Game'
+    )
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--length', type=int, default=1000)
+    parser.add_argument('--reference-games', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--shape-size', type=int, default=data.DEFAULT_SHAPE_SIZE)
+    parser.add_argument('--shape-set', default=None, help='defaults to every set')
+    parser.add_argument('--out', default=None,
+                        help='.npy file for the sequences, named per set if there are several')
+    args = parser.parse_args()
+
+    shape_sets = list(data.SHAPES[args.shape_size].keys())
+    if args.shape_set is not None:
+        shape_sets = [args.shape_set]
+    passed = True
+    for shape_set in shape_sets:
+        start = time.perf_counter()
+        codes = generate(args.games, args.length, args.shape_size, shape_set, args.seed)
+        seconds = time.perf_counter() - start
+        print('%s: %d draws in %.2f seconds' % (shape_set, codes.size, seconds))
+        if args.out is not None:
+            path = args.out if len(shape_sets) == 1 else '%s-%s.npy' % (args.out, shape_set)
+            np.save(path, codes)
+        report, ok = check(codes, args.shape_size, shape_set,
+                           args.reference_games, args.seed + 1)
+        for key, (chi2, df, p) in report.items():
+            print('%10s: chi2 %10.2f  df %5d  p %.4f' % (key, chi2, df, p))
+        passed = passed and ok
+
+        same, report, ok = check_history(args.reference_games, args.length, args.shape_size,
+                                         shape_set, args.seed + 2)
+        print('%s: ShapeHistory %s data.get_random_shape draw for draw' % (
+            shape_set, 'matches' if same else 'DIFFERS from'
+        ))
+        for key, (chi2, df, p) in report.items():
+            print('%10s: chi2 %10.2f  df %5d  p %.4f' % (key, chi2, df, p))
+        passed = passed and ok
+    print('passed' if passed else 'FAILED')
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import struct
+
+import archive
+import replay
+from game import GameFrame, TetrisApp
+
+"""
+A session file holds the settings of a TetrisApp and the
+state of each of its players' games. Integers are varints
+as in replay.py, and strings are a varint length followed
+by their utf-8 bytes.
+
+file:   MAGIC, VERSION (one byte), then shape_size,
+        num_rows, num_cols, the number of players,
+        speed_index, shape_set and the color scheme,
+        then each player in order
+player: the game's seed, the length and bytes of an
+        archive keyframe of its state, its period as a
+        little-endian double, and one of the PAUSE_STATES
+"""
+MAGIC = b'TSES'
+VERSION = 1
+NOT_STARTED, RUNNING, PAUSED, OVER = PAUSE_STATES = range(4)
+
+
+def _write_string(out: bytearray, string: str):
+    data = string.encode('utf-8')
+    replay.write_varint(out, len(data))
+    out += data
+
+
+def _read_string(buf, pos: int):
+    length, pos = replay.read_varint(buf, pos)
+    return bytes(buf[pos:pos + length]).decode('utf-8'), pos + length
+
+
+def pause_state(frame: GameFrame):
+    if not hasattr(frame, 'un_paused'):
+        return NOT_STARTED
+    if frame.un_paused is None:
+        return OVER
+    return RUNNING if frame.un_paused else PAUSED
+
+
+def dumps(app: TetrisApp):
+    """
+    returns the bytes of a session file for app.
+    """
+    game = app.players[0].game
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    for value in (app.shape_size, game.dmn.y, game.dmn.x, len(app.players),
+                  app.speed_index_int_var.get()):
+        replay.write_varint(out, value)
+    _write_string(out, app.shapes_string_var.get())
+    _write_string(out, app.cs_string_var.get())
+
+    for frame in app.players:
+        keyframe = archive.encode_state(frame.game)
+        replay.write_varint(out, frame.game.seed)
+        replay.write_varint(out, len(keyframe))
+        out += keyframe
+        out += struct.pack('<d', frame.period)
+        out.append(pause_state(frame))
+    return bytes(out)
+
+
+def loads(buf):
+    """
+    returns a new TetrisApp in the state of the bytes
+    of a session file. each game's canvas is redrawn
+    in one pass, as by GameFrame.redraw_grid.
+    """
+    assert bytes(buf[:len(MAGIC)]) == MAGIC, 'not a session file'
+    assert buf[len(MAGIC)] == VERSION, 'unknown session version %d' % buf[len(MAGIC)]
+    pos = len(MAGIC) + 1
+    values = []
+    for _ in range(5):
+        value, pos = replay.read_varint(buf, pos)
+        values.append(value)
+    shape_size, num_rows, num_cols, num_players, speed_index = values
+    shape_set, pos = _read_string(buf, pos)
+    color_scheme, pos = _read_string(buf, pos)
+
+    app = TetrisApp(shape_size, num_rows, num_cols, num_players)
+    app.speed_index_int_var.set(speed_index)
+    app.shapes_string_var.set(shape_set)
+    app.cs_string_var.set(color_scheme)
+
+    settings = (shape_size, num_rows, num_cols, shape_set)
+    for frame in app.players:
+        seed, pos = replay.read_varint(buf, pos)
+        length, pos = replay.read_varint(buf, pos)
+        header = replay.Header(seed, settings, speed_index)
+        frame.set_game(archive.decode_state(buf[pos:pos + length], header))
+        pos += length
+        frame.period, = struct.unpack_from('<d', buf, pos)
+        pos += 8
+        state = buf[pos]
+        pos += 1
+
+        if state == NOT_STARTED:
+            continue
+        frame.score.set('%d : %d' % (frame.game.lines, frame.game.score))
+        if state == OVER:
+            frame.un_paused = None
+        elif state == PAUSED:
+            frame.un_paused = False
+        else:
+            frame.un_paused = True
+            frame.un_pause_gravity()
+    return app
+
+
+def save(app: TetrisApp, path: str):
+    with open(path, 'wb') as f:
+        f.write(dumps(app))
+
+
+def load(path: str):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def save_on_close(app: TetrisApp, path: str):
+    """
+    saves the session to path when app's window is closed.
+    """
+    def close():
+        save(app, path)
+        app.destroy()
+    app.protocol('WM_DELETE_WINDOW', close)
+
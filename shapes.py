@@ -1,5 +1,8 @@
 from math import ceil
 
+SHIFT_X = (0, 1, 0, -1)  # horizontal lookahead offsets for each direction
+SHIFT_Y = (-1, 0, 1, 0)  # vertical lookahead offsets for each direction
+
 
 class Pair:
     """
@@ -13,9 +16,7 @@ class Pair:
         self.y = y
 
     def shift(self, direction: int):
-        la_x = (0, 1, 0, -1)  # horizontal lookahead offsets
-        la_y = (-1, 0, 1, 0)  # vertical lookahead offsets
-        return Pair(self.x + la_x[direction], self.y + la_y[direction])
+        return Pair(self.x + SHIFT_X[direction], self.y + SHIFT_Y[direction])
 
     def __eq__(self, other):
         if not isinstance(other, Pair):
@@ -72,6 +73,21 @@ class Tile:
         return self.p[0].y
 
 
+def row_masks(offsets: ((int, int), )):
+    """
+    returns the x offset of the leftmost of the offsets,
+    and their (y offset, row bitmask) pairs with that
+    offset at bit 0. bitmasks are empty for no offsets.
+    """
+    if not offsets:
+        return 0, ()
+    min_x = min(map(lambda o: o[0], offsets))
+    rows = {}
+    for x, y in offsets:
+        rows[y] = rows.get(y, 0) | (1 << (x - min_x))
+    return min_x, tuple(sorted(rows.items()))
+
+
 class Shape:
     """
     A collection of uniquely positioned
@@ -81,11 +97,25 @@ class Shape:
     rule: height <= base.
     The game using this shape will require
     that base, height <= shape_size.
+
+    All of the tables below are built once by the
+    constructor, and are indexed first by rotation.
+    Offsets are (x, y) tuples relative to the pivot.
     """
 
     name: str
     tiles: (Tile, )
     faces: ((Tile, ), (Tile, ), (Tile, ), (Tile, ))
+    offsets: ((tuple, ), ) * 4      # per rotation: the offset of every tile
+    edges: ((tuple, ), ) * 4        # per rotation, direction: offsets newly covered by a shift
+    extremes: ((int, ), ) * 4       # per rotation, direction: see Shape.extreme
+    rot_deltas: ((tuple, ), ) * 4   # per rotation, angle: offsets newly covered by rotating
+    bottoms: ((tuple, ), ) * 4      # per rotation: (x offset, lowest y offset) of each column
+    unique_rots: (int, )            # rotations that aren't a translation of an earlier one
+    mask_x: (int, int, int, int)    # x offset of bit 0 of each rotation's row masks
+    masks: ((tuple, ), ) * 4        # per rotation: (y offset, row bitmask) pairs
+    edge_masks: ((tuple, ), ) * 4   # per rotation, direction: edges as (x offset of bit 0, masks)
+    rot_delta_masks: ((tuple, ), ) * 4  # per rotation, angle: rot_deltas as (x offset of bit 0, masks)
 
     def __init__(self, pairs: ((int, int), ), name: str):
         self.name = name
@@ -133,6 +163,72 @@ class Shape:
         self.faces = (tuple(face_000), tuple(face_090),
                       tuple(face_180), tuple(face_270))
 
+        self.offsets = tuple(
+            tuple((t.p[rot].x, t.p[rot].y) for t in self.tiles)
+            for rot in range(4)
+        )
+
+        # cells that become covered when shifting or
+        # rotating, given that the current cells are free
+        edges = []
+        rot_deltas = []
+        for rot in range(4):
+            covered = set(self.offsets[rot])
+            edges.append(tuple(
+                tuple((x + SHIFT_X[d], y + SHIFT_Y[d])
+                      for x, y in self.offsets[rot]
+                      if (x + SHIFT_X[d], y + SHIFT_Y[d]) not in covered)
+                for d in range(4)
+            ))
+            rot_deltas.append(tuple(
+                tuple(o for o in self.offsets[(rot + angle) % 4] if o not in covered)
+                for angle in range(4)
+            ))
+        self.edges = tuple(edges)
+        self.rot_deltas = tuple(rot_deltas)
+
+        bottoms = []
+        for offsets in self.offsets:
+            lowest = {}
+            for x, y in offsets:
+                if x not in lowest or y < lowest[x]:
+                    lowest[x] = y
+            bottoms.append(tuple(sorted(lowest.items())))
+        self.bottoms = tuple(bottoms)
+
+        unique_rots = []
+        seen = set()
+        for rot, offsets in enumerate(self.offsets):
+            min_x = min(map(lambda o: o[0], offsets))
+            min_y = min(map(lambda o: o[1], offsets))
+            normal = frozenset((x - min_x, y - min_y) for x, y in offsets)
+            if normal not in seen:
+                seen.add(normal)
+                unique_rots.append(rot)
+        self.unique_rots = tuple(unique_rots)
+
+        extremes = []
+        for rot in range(4):
+            row = []
+            for direction in range(4):
+                pair = self.faces[(rot + direction) % 4][0].p[rot]
+                row.append(pair.y if direction % 2 == 0 else pair.x)
+            extremes.append(tuple(row))
+        self.extremes = tuple(extremes)
+
+        # row bitmasks for each rotation, shifted so that
+        # the leftmost tile of the rotation sits at bit 0
+        mask_x = []
+        masks = []
+        for offsets in self.offsets:
+            min_x, rows = row_masks(offsets)
+            mask_x.append(min_x)
+            masks.append(rows)
+        self.mask_x = tuple(mask_x)
+        self.masks = tuple(masks)
+        self.edge_masks = tuple(tuple(map(row_masks, edges)) for edges in self.edges)
+        self.rot_delta_masks = tuple(tuple(map(row_masks, deltas)) for deltas in self.rot_deltas)
+
     def __eq__(self, other):
         if not isinstance(other, Shape):
             return False
@@ -150,9 +246,4 @@ class Shape:
         in its current rotation with respect to
         the specified direction.
         """
-        tile = self.faces[(rot + direction) % 4][0]
-        pair = tile.p[rot]
-        if direction % 2 is 0:
-            return pair.y
-        else:
-            return pair.x
+        return self.extremes[rot][direction]
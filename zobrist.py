@@ -0,0 +1,131 @@
+import random
+from collections import OrderedDict
+
+KEY_BITS = 64
+KEY_SEED = 0x5eed     # keys are the same in every process, so hashes can be shared
+EVICTION_WINDOW = 4   # number of least recently used entries considered for eviction
+
+_tables = {}
+
+
+def keys(num_rows: int, num_cols: int):
+    """
+    returns a table of random keys, one for each cell,
+    indexed [y][x]. a board's hash is the xor of the
+    keys of its occupied cells, so filling or emptying
+    a cell toggles its key in or out of the hash.
+    """
+    dims = (num_rows, num_cols)
+    if dims not in _tables:
+        rng = random.Random(KEY_SEED)
+        _tables[dims] = tuple(
+            tuple(rng.getrandbits(KEY_BITS) for x in range(num_cols))
+            for y in range(num_rows)
+        )
+    return _tables[dims]
+
+
+def hash_columns(table: ((int, ), ), columns: [int, ]):
+    """
+    returns the hash of a board given as one occupancy
+    bitmask per column, where bit y is row y.
+    """
+    h = 0
+    for x, mask in enumerate(columns):
+        while mask:
+            low = mask & -mask
+            h ^= table[low.bit_length() - 1][x]
+            mask ^= low
+    return h
+
+
+class Entry:
+    """
+    What a search found out about a position.
+    """
+    depth: int      # number of plies searched below the position
+    value: float
+    move: object    # the best move found, if any
+
+    def __init__(self, depth: int, value: float, move: object = None):
+        self.depth = depth
+        self.value = value
+        self.move = move
+
+
+class TranspositionTable:
+    """
+    A bounded map from position keys to Entries.
+
+    Entries are kept in least recently used order.
+    When the table is full, the shallowest of the
+    EVICTION_WINDOW least recently used entries is
+    evicted, so that entries which took longer to
+    search are kept for longer.
+    """
+    capacity: int
+    entries: OrderedDict
+    hits: int = 0       # lookups answered by an entry searched deep enough
+    misses: int = 0     # lookups with no entry, or one too shallow
+    stores: int = 0
+    evictions: int = 0
+
+    def __init__(self, capacity: int = 1 << 16):
+        assert capacity > 0
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def lookup(self, key, depth: int):
+        """
+        returns the entry for key if it was
+        searched at least depth plies, or None.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry.depth < depth:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def store(self, key, depth: int, value: float, move: object = None):
+        """
+        an existing entry for key is only
+        replaced by one searched as deep.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            if entry.depth > depth:
+                return
+        elif len(self.entries) >= self.capacity:
+            self.evict()
+        self.entries[key] = Entry(depth, value, move)
+        self.stores += 1
+
+    def evict(self):
+        oldest = None
+        for i, (key, entry) in enumerate(self.entries.items()):
+            if i == EVICTION_WINDOW:
+                break
+            if oldest is None or entry.depth < self.entries[oldest].depth:
+                oldest = key
+        del self.entries[oldest]
+        self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.stores = self.evictions = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return '%d/%d entries  %d hits  %d misses (%.1f%%)  %d stores  %d evictions' % (
+            len(self.entries), self.capacity, self.hits, self.misses,
+            100 * self.hit_rate(), self.stores, self.evictions
+        )